@@ -3,31 +3,93 @@ A sample of 8 of the 26 Bootstrap themed Plotly figure templates available
 in the dash-bootstrap-template library
 
 """
-from dash import Dash, html, dcc
+from dash import Dash, html, dcc, ALL, Patch, ctx
 import dash_bootstrap_components as dbc
-from dash_bootstrap_templates import (
-    ThemeChangerAIO,
-    template_from_url,
-    load_figure_template,
-)
-import plotly.express as px
-import data_youth
-import data_adult
-from dash.dependencies import Input, Output, State
+from dash_bootstrap_templates import ThemeChangerAIO
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 from controls import geo_list, year_list
-import plotly.graph_objs as go
+from figure_cache import figures, get_figure, normalize_args
+from patches import figure_patch
+from themes import apply_theme, theme_patch
+from flask import request
+import copy
+import functools
+import importlib
+import os
+import sys
+import geo
+import metrics
+import profiling
+
+# FAST_STARTUP=1 defers everything not needed to accept requests to the first
+# page load: the chart modules (and pandas/plotly express with them) and the
+# prerendered default view. See startup.py for an import-time report.
+FAST_STARTUP = os.environ.get("FAST_STARTUP", "") not in ("", "0")
 
-df = px.data.gapminder()
 geos = geo_list()
 allprovince = [geos[0]]
 years = year_list()
 
+# control values of the default view (adult tab), whose figures are rendered at
+# startup and shipped in the layout, see prerender. The map's year comes from
+# the data, see default_values.
+DEFAULTS = {
+    "years": [years[0], years[-1]],
+    "provinces": allprovince,
+    "radio": "Incarceration",
+    "youth-radio": "Incarceration",
+    "radio2": "Female",
+    "map-year": None,
+}
+DEFAULT_THEME = dbc.themes.BOOTSTRAP
+
 # stylesheet with the .dbc class
 dbc_css = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.min.css"
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc_css])
 
+# callback latency, payload size and error metrics at /metrics
+metrics.instrument(app)
+# opt-in callback profiles, see profiling.py
+profiling.instrument(app)
+
+
+# the map boundaries are versioned by a hash in their url (see geo.py), so
+# browsers can keep them for good instead of revalidating on every visit
+@app.server.after_request
+def cache_geojson(response):
+    if request.path.startswith("/assets/geo/"):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+    return response
+
+
+# seconds between checks of the dataset files for republished tables, 0 to
+# never reload them while running (see tables.watch)
+WATCH_INTERVAL = float(os.environ.get("DATASET_WATCH_INTERVAL", 30))
+
+
+# the watcher is started by the first request of each process rather than at
+# import: gunicorn imports the app before forking, and threads do not survive
+# the fork
+@app.server.before_request
+def watch_dataset():
+    tables = importlib.import_module("tables")
+    tables.watch(WATCH_INTERVAL)
+
+
+def figure_id(name):
+    # pattern-matching id so the theme callback can reach every graph
+    return {"type": "figure", "index": name}
+
+
 # theme changer button
-theme_changer = html.Div(ThemeChangerAIO(aio_id="theme"), className="mb-4")
+theme_changer = html.Div(
+    ThemeChangerAIO(aio_id="theme", radio_props={"value": DEFAULT_THEME}),
+    className="mb-4",
+)
 
 # update alert
 alert = html.Div(
@@ -58,7 +120,7 @@ checklist = html.Div(
         dbc.Checklist(
             id="provinces",
             options=[{"label": i, "value": i} for i in geos],
-            value=allprovince,
+            value=DEFAULTS["provinces"],
             inline=False,
         ),
     ],
@@ -75,7 +137,7 @@ slider = html.Div(
             min=years[0],
             max=years[-1],
             step=1,
-            value=[years[0], years[-1]],
+            value=DEFAULTS["years"],
             marks=marks,
             tooltip={"always_visible": False, "placement": "topLeft"},
         ),
@@ -89,28 +151,30 @@ controls = dbc.Card(
     body=True,
 )
 
-# radio items for youth tab only (incarceration vs probation)
-radio = html.Div(
-    dcc.RadioItems(
-        options=[
-            {
-                "label": "Incarceration",
-                "value": "Incarceration",
-            },
-            {
-                "label": "Probation",
-                "value": "Probation",
-            },
-        ],
-        value="Incarceration",
-        inline=True,
-        id="radio",
-        inputClassName="mx-2 form-check-input",
-    ),
-    className="mt-4",
-)
+# radio items for the rate figures (incarceration vs probation), one per tab
+def rate_radio(radio_id):
+    return html.Div(
+        dcc.RadioItems(
+            options=[
+                {
+                    "label": "Incarceration",
+                    "value": "Incarceration",
+                },
+                {
+                    "label": "Probation",
+                    "value": "Probation",
+                },
+            ],
+            value=DEFAULTS[radio_id],
+            inline=True,
+            id=radio_id,
+            inputClassName="mx-2 form-check-input",
+        ),
+        className="mt-4",
+    )
+
 
-# radio items for youth tab only (male vs female)
+# radio items for adult tab only (male vs female)
 radio2 = html.Div(
     dcc.RadioItems(
         options=[
@@ -123,27 +187,91 @@ radio2 = html.Div(
                 "value": "Female",
             },
         ],
-        value="Female",
+        value=DEFAULTS["radio2"],
         inline=True,
         id="radio2",
         inputClassName="mx-2 form-check-input",
     ),
 )
 
+
+# every graph has its own spinner and callback, so it shows up as soon as its
+# figure is ready instead of waiting for the whole tab. The store next to it
+# remembers the arguments of the figure on display, see register_figure; the
+# other one fires the callback of a default figure the page came without, see
+# serve_layout.
+graphs = {}  # name -> (dcc.Graph, dcc.Store), filled in by serve_layout
+
+
+def graph(name):
+    graphs[name] = (
+        dcc.Graph(id=figure_id(name), className="m-4"),
+        dcc.Store(id={"type": "figure-args", "index": name}),
+    )
+    return html.Div(
+        [
+            dcc.Loading(graphs[name][0], type="circle"),
+            graphs[name][1],
+            dcc.Store(id={"type": "figure-load", "index": name}),
+        ]
+    )
+
+
+# names of the default figures a page is served without, see serve_layout
+pending_figures = dcc.Store(id="pending-figures", data=[])
+
+
+# year player of the map: the map holds a single fiscal year and stepping
+# through the years fetches one small frame at a time, see adults_rates_geomap.
+# Each page gets the default year, see serve_layout.
+map_year = dcc.Slider(
+    id="map-year",
+    min=years[0],
+    max=years[-1] - 1,
+    step=1,
+    marks=marks,
+)
+map_player = html.Div(
+    [
+        dbc.Button("Play", id="map-play", size="sm", className="me-3"),
+        html.Div(map_year, className="flex-grow-1"),
+        dcc.Interval(id="map-interval", interval=1000, disabled=True),
+    ],
+    className="d-flex align-items-center mx-4",
+)
+
+
+adult_figures = [
+    rate_radio("radio"),
+    graph("fig12"),
+    map_player,
+    graph("fig7"),
+    graph("fig8"),
+    radio2,
+    graph("fig9"),
+    graph("fig10"),
+    graph("fig11"),
+]
+youth_figures = [
+    rate_radio("youth-radio"),
+    graph("fig4"),
+    graph("fig1"),
+    graph("fig2"),
+    graph("fig3"),
+    graph("fig5"),
+    graph("fig6"),
+]
+
 # tabs
 tabs = dbc.Tabs(
     [
         dbc.Tab(
-            dcc.Loading(
-                id="loading", type="circle", className= "mt-5 pt-5", children=[dbc.Row(id="adult-figures")]
-            ),
+            dbc.Row(adult_figures, id="adult-figures", className="mt-5 pt-5"),
             label="Adult",
             tab_id="adult",
         ),
         dbc.Tab(
-            dcc.Loading(
-                id="loading-1", type="circle", className="mt-5 pt-5", children=[dbc.Row(id="youth-figures")]
-            ),
+            dbc.Row(youth_figures, id="youth-figures", className="mt-5 pt-5"),
             label="Youth",
             tab_id="youth",
         ),
@@ -153,7 +281,7 @@ tabs = dbc.Tabs(
 )
 
 # app layout
-app.layout = html.Div(
+layout = html.Div(
     [
         dbc.Container(header, fluid=True, className="dbc"),
         dbc.Container(
@@ -168,201 +296,371 @@ app.layout = html.Div(
                         dbc.Col(tabs, width=10, className="custom-scrollbar px-4"),
                     ],
                 ),
-                dbc.Row(
-                    [
-                        radio,
-                        radio2,
-                        dcc.Graph(id="fig4", className="m-4"),
-                        dcc.Graph(id="fig9", className="m-4"),
-                        dcc.Graph(id="fig12", className="m-4"),
-                    ],
-                    className="d-none",
-                ),
             ],
             fluid=True,
             className="dbc",
         ),
+        pending_figures,
     ]
 )
 
+# clientside callbacks for the controls, see assets/scripts.js
+
 # callback to disable provinces checklist when allprovinces is selected
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="update_checklist"),
     Output("provinces", "options"),
     Input("provinces", "value"),
     State("provinces", "options"),
 )
-def update_checklist(selected_value, options):
-    if allprovince[0] in selected_value:
-        # Disable all options except the first one
-        new_options = []
-        new_options.append(options[0])
-        for option in options[1:]:
-            new_option = option.copy()
-            new_option["disabled"] = True
-            new_options.append(new_option)
-        return new_options
-    else:
-        # Enable all options
-        for option in options:
-            option["disabled"] = False
-        return options
-
 
 # callback for slider
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="update_slider_min"),
     Output("years", "min"),
     Input("tabs", "active_tab"),
-    Input("youth-figures", "children"),
 )
-def update_slider_min(active_tab, children):
-    if active_tab == "youth":
-        return 1997
-    return 2000
-
 
 # callback for alert
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="toggle_alert"),
     Output("alert-auto", "is_open"),
     Input("years", "value"),
     Input("provinces", "value"),
-    [State("alert-auto", "is_open")],
+    State("alert-auto", "is_open"),
 )
-def toggle_alert(years, provinces, is_open):
-    if years is not None and provinces is not None:
-        return not is_open
-    return is_open
-
 
-# callback for tabs
-@app.callback(
-    Output("youth-figures", "children"),
-    Output("adult-figures", "children"),
-    Input("tabs", "active_tab"),
+# callback for the map's year slider: keep it within the selected years
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="update_map_years"),
+    Output("map-year", "min"),
+    Output("map-year", "max"),
+    Output("map-year", "value"),
     Input("years", "value"),
-    Input("provinces", "value"),
-    Input(ThemeChangerAIO.ids.radio("theme"), "value"),
+    State("map-year", "value"),
+    prevent_initial_call=True,
+)
+
+# callback for the map's play button: step the year slider on each tick
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="play_map"),
+    Output("map-interval", "disabled"),
+    Output("map-play", "children"),
+    Output("map-year", "value", allow_duplicate=True),
+    Input("map-play", "n_clicks"),
+    Input("map-interval", "n_intervals"),
+    State("map-interval", "disabled"),
+    State("map-year", "value"),
+    State("map-year", "min"),
+    State("map-year", "max"),
+    prevent_initial_call=True,
 )
-def render_tab_content(active_tab, years, provinces, theme):
+
+# callback firing the figure callbacks of the default view the page was served
+# without, see serve_layout
+app.clientside_callback(
+    ClientsideFunction(namespace="controls", function_name="load_figures"),
+    Output({"type": "figure-load", "index": ALL}, "data"),
+    Input("pending-figures", "data"),
+)
+
+
+# figures of each tab: (graph name, figure function as "module.function", ids of
+# the controls it depends on, figure function arguments built from those
+# controls' values). The chart modules are imported on first use.
+FIGURES = {
+    "adult": [
+        (
+            "fig12",
+            "data_adult.adults_rates_geomap",
+            ["years", "radio", "map-year"],
+            lambda years, rate_type, year: (years[0], years[1], None, rate_type, year),
+        ),
+        (
+            "fig7",
+            "data_adult.adult_admissions_3dtrend",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig8",
+            "data_adult.adult_custody_admissions_age_group",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig9",
+            "data_adult.adult_custody_gender_heatmap",
+            ["years", "provinces", "radio2"],
+            lambda years, provinces, sex: (sex, years[0], years[1], None, provinces),
+        ),
+        (
+            "fig10",
+            "data_adult.adult_indigenous_vs_nonindigenous",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig11",
+            "data_adult.adult_sentence_length_by_sex",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+    ],
+    "youth": [
+        (
+            "fig4",
+            "data_youth.youth_in_correctional_services_trend_3d",
+            ["years", "provinces", "youth-radio"],
+            lambda years, provinces, rate_type: (
+                years[0],
+                years[1],
+                None,
+                rate_type,
+                provinces,
+            ),
+        ),
+        (
+            "fig1",
+            "data_youth.youth_indigenous_vs_nonindigenous",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig2",
+            "data_youth.youth_commencing_correctional_services",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig3",
+            "data_youth.youth_admissions_and_releases_to_correctional_services",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig5",
+            "data_youth.youth_gender_trends_and_pie",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+        (
+            "fig6",
+            "data_youth.youth_age_by_geo",
+            ["years", "provinces"],
+            lambda years, provinces: (years[0], years[1], None, provinces),
+        ),
+    ],
+}
+
+EMPTY_FIGURE = {"data": [], "layout": {}}
+
+
+@functools.lru_cache(maxsize=None)
+def figure_function(path):
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+# controls whose changes are answered with a Patch when the figure keeps its
+# structure: the year range and the year shown on the map
+PATCHED_INPUTS = {"years.value", "map-year.value"}
+
+
+def figure_args(control_ids, arguments, values):
+    """Normalized figure function arguments for the values of a figure's
+    controls, or None when no province is selected"""
+    controls = dict(zip(control_ids, values))
+    if "provinces" in controls:
+        if not controls["provinces"]:
+            return None
+        if allprovince[0] in controls["provinces"]:
+            controls["provinces"] = allprovince
+    return normalize_args(arguments(*controls.values()))
+
+
+def compute_tab(tab, values):
     """
-    This callback takes the 'active_tab' property as input, as well as the
-    stored graphs, and renders the tab content depending on what the value of
-    'active_tab' is.
+    The figures of a tab for control values {control id: value}, as {graph
+    name: (figure arguments, figure)}, for each figure whose controls all have
+    a value (None for both when no province is selected). They are computed
+    one after the other and put in the figure cache, for prerender and the
+    gunicorn preload. A figure that fails is reported and left out, so it
+    does not hold back the others; its callback tries again.
     """
-    start_year = years[0]
-    end_year = years[1]
-    if allprovince[0] in provinces:
-        provinces = allprovince
-    if active_tab is not None and len(provinces) != 0 and years is not None:
-        if active_tab == "youth":
-            # figures for youth tab
-            fig1 = data_youth.youth_indigenous_vs_nonindigenous(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig2 = data_youth.youth_commencing_correctional_services(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig3 = data_youth.youth_admissions_and_releases_to_correctional_services(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig5 = data_youth.youth_gender_trends_and_pie(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig6 = data_youth.youth_age_by_geo(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            youth_graphs = [
-                radio,
-                dcc.Graph(id="fig4", className="m-4"),
-                dcc.Graph(figure=fig1, className="m-4"),
-                dcc.Graph(figure=fig2, className="m-4"),
-                dcc.Graph(figure=fig3, className="m-4"),
-                dcc.Graph(figure=fig5, className="m-4"),
-                dcc.Graph(figure=fig6, className="m-4"),
-            ]
-            years = year_list()
-            return (youth_graphs, [])
-
-        elif active_tab == "adult":
-            # figures for adult tab
-            fig7 = data_adult.adult_admissions_3dtrend(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig8 = data_adult.adult_custody_admissions_age_group(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig10 = data_adult.adult_indigenous_vs_nonindigenous(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-            fig11 = data_adult.adult_sentence_length_by_sex(
-                start_year, end_year, template_from_url(theme), provinces
-            )
-
-            adult_graphs = [
-                radio,
-                dcc.Graph(id="fig12", className="m-4"),
-                dcc.Graph(figure=fig7, className="m-4"),
-                dcc.Graph(figure=fig8, className="m-4"),
-                radio2,
-                dcc.Graph(id="fig9", className="m-4"),
-                dcc.Graph(figure=fig10, className="m-4"),
-                dcc.Graph(figure=fig11, className="m-4"),
-            ]
-            return ([], adult_graphs)
-    return [], []
-
-
-# callback for radio youth
-@app.callback(
-    Output("fig4", "figure"),
-    Input("tabs", "active_tab"),
-    Input("radio", "value"),
-    Input("provinces", "value"),
-    Input("years", "value"),
-    Input(ThemeChangerAIO.ids.radio("theme"), "value"),
-    Input("youth-figures", "children"),
-)
-def update_radio(active_tabs, value, provinces, years, theme, children):
-    if active_tabs == "youth":
-        fig = data_youth.youth_in_correctional_services_trend_3d(
-            years[0], years[-1], template_from_url(theme), value, provinces
-        )
-        return fig
+    results = {}
+    for name, path, control_ids, arguments in FIGURES[tab]:
+        if not all(c in values for c in control_ids):
+            continue
+        args = figure_args(control_ids, arguments, [values[c] for c in control_ids])
+        try:
+            fig = None if args is None else figures.warm(figure_function(path), *args)
+        except Exception as e:
+            print(f"computing {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        results[name] = (args, fig)
+    return results
+
+
+def register_figure(tab, name, path, control_ids, arguments):
+    """
+    Add the callback of one graph. Each figure is computed in its own request,
+    so the browser fetches them concurrently and a slow figure does not hold
+    back the others.
+
+    The graph's store holds the (normalized) arguments of the figure on
+    display: nothing is sent when they are unchanged, and when only the years
+    moved (see PATCHED_INPUTS) the response is a Patch of the values that
+    differ.
+    """
+    args_id = {"type": "figure-args", "index": name}
+
+    def update_figure(active_tab, load, *values):
+        *values, shown_args, theme = values
+        if active_tab != tab:
+            raise PreventUpdate
+        args = figure_args(control_ids, arguments, values)
+        if args is None:
+            return apply_theme(EMPTY_FIGURE, theme), None
+        if args == shown_args:
+            raise PreventUpdate
+
+        func = figure_function(path)
+        fig = get_figure(func, *args)
+        if shown_args is not None and set(ctx.triggered_prop_ids) <= PATCHED_INPUTS:
+            # both themed, so the patch keeps the theme's trace colours
+            old = apply_theme(figures.peek(func, *shown_args), theme)
+            patch = figure_patch(old, apply_theme(fig, theme))
+            if patch is not None:
+                return patch, args
+        return apply_theme(fig, theme), args
 
+    update_figure.__name__ = f"update_{path.rsplit('.', 1)[1]}"
+    app.callback(
+        Output(figure_id(name), "figure"),
+        Output(args_id, "data"),
+        Input("tabs", "active_tab"),
+        Input({"type": "figure-load", "index": name}, "data"),
+        *[Input(control_id, "value") for control_id in control_ids],
+        State(args_id, "data"),
+        State(ThemeChangerAIO.ids.radio("theme"), "value"),
+        # the default view is part of the layout, see serve_layout
+        prevent_initial_call=True,
+    )(update_figure)
 
-# callback for radio adult
+
+def default_values():
+    """
+    DEFAULTS with the map's year: the first fiscal year of the rates table
+    within the default years. It reads the data, so with FAST_STARTUP it is
+    first called on the first page load.
+    """
+    values = dict(DEFAULTS)
+    map_years = figure_function("data_adult.adults_rates_years")(*DEFAULTS["years"])
+    values["map-year"] = map_years[0] if map_years else DEFAULTS["years"][0]
+    return values
+
+
+def prerender(tab):
+    """
+    Compute the figures of a tab for the default control values into the
+    figure cache, where serve_layout finds them: at startup, or in the
+    gunicorn master before forking (see wsgi.py).
+    """
+    compute_tab(tab, default_values())
+
+
+for tab, tab_figures in FIGURES.items():
+    for name, path, control_ids, arguments in tab_figures:
+        register_figure(tab, name, path, control_ids, arguments)
+
+
+_themed = {}  # graph name -> (cached figure, the figure themed for the layout)
+
+
+def serve_layout():
+    """
+    A copy of the layout for one page, with the default view's figures as
+    the figure cache holds them, so the first paint needs no callback round
+    trip. No figure is computed here: a figure not cached, e.g. the first page
+    with FAST_STARTUP or after its table was reloaded (see tables.watch), is
+    listed in pending-figures, and its callback fetches it once the page has
+    loaded, concurrently with the others.
+    """
+    values = default_values()
+    memo = {}
+    page = copy.deepcopy(layout, memo)
+    memo[id(map_year)].value = values["map-year"]
+    pending = []
+    for name, path, control_ids, arguments in FIGURES["adult"]:
+        args = figure_args(control_ids, arguments, [values[c] for c in control_ids])
+        fig = None if args is None else figures.peek(figure_function(path), *args)
+        if fig is None:
+            pending.append(name)
+            continue
+        cached, themed = _themed.get(name, (None, None))
+        if cached is not fig:
+            themed = apply_theme(fig, DEFAULT_THEME)
+            _themed[name] = (fig, themed)
+        graph, store = (memo[id(component)] for component in graphs[name])
+        graph.figure = themed
+        store.data = args
+    memo[id(pending_figures)].data = pending
+    return page
+
+
+# the same components, so assigning the layout function does not call it to
+# validate the callbacks
+app.validation_layout = layout
+app.layout = serve_layout
+if not FAST_STARTUP:
+    prerender("adult")
+
+
+# figure function path of each graph
+FIGURE_PATHS = {
+    name: path for tab_figures in FIGURES.values() for name, path, _, _ in tab_figures
+}
+
+
+# callback for theme: restyle the figures on the page without recomputing them.
+# The cached figure each graph shows (per its store) gives the template colours
+# to map to the theme's; a figure no longer cached only gets the template.
 @app.callback(
-    Output("fig12", "figure"),
-    Input("tabs", "active_tab"),
-    Input("radio", "value"),
-    Input("years", "value"),
+    Output(figure_id(ALL), "figure", allow_duplicate=True),
     Input(ThemeChangerAIO.ids.radio("theme"), "value"),
-    Input("adult-figures", "children"),
+    State({"type": "figure-args", "index": ALL}, "data"),
+    prevent_initial_call=True,
 )
-def update_radio(active_tabs, value, years, theme, children):
-    if active_tabs == "adult":
-        fig = data_adult.adults_rates_geomap(
-            years[0], years[-1], template_from_url(theme), value
-        )
-        return fig
-    return []
-
-# callback for radio2
+def update_theme(theme, shown_args):
+    shown = {
+        state["id"]["index"]: state.get("value") for state in ctx.states_list[0]
+    }
+    patches = []
+    for output in ctx.outputs_list:
+        name = output["id"]["index"]
+        args = shown.get(name)
+        fig = None
+        if args is not None:
+            fig = figures.peek(figure_function(FIGURE_PATHS[name]), *args)
+        patches.append(theme_patch(theme, fig))
+    return patches
+
+
+# callback for the map: swap in finer boundaries when zooming in, coarser ones
+# when zooming back out
 @app.callback(
-    Output("fig9", "figure"),
-    Input("tabs", "active_tab"),
-    Input("radio2", "value"),
-    Input("provinces", "value"),
-    Input("years", "value"),
-    Input(ThemeChangerAIO.ids.radio("theme"), "value"),
-    Input("adult-figures", "children"),
+    Output(figure_id("fig12"), "figure", allow_duplicate=True),
+    Input(figure_id("fig12"), "relayoutData"),
+    prevent_initial_call=True,
 )
-def update_radio2(active_tabs, value, provinces, years, theme, children):
-    if active_tabs == "adult":
-        fig = data_adult.adult_custody_gender_heatmap(
-            value, years[0], years[-1], template_from_url(theme), provinces
-        )
-        return fig
-    return []
+def update_map_resolution(relayout):
+    scale = (relayout or {}).get("geo.projection.scale")
+    if scale is None:
+        raise PreventUpdate
+    patch = Patch()
+    patch["data"][0]["geojson"] = geo.geojson_url(geo.level_for_scale(scale))
+    return patch
+
 
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    app.run(debug=True)
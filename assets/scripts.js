@@ -0,0 +1,65 @@
+// clientside callbacks for the controls: they only touch component props, so
+// they run in the browser instead of taking a server round trip
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  controls: {
+    // disable the provinces checklist when "All Provinces and territories"
+    // (the first option) is selected
+    update_checklist: function (selected, options) {
+      const allProvinces = options[0].value;
+      const disable = selected.includes(allProvinces);
+      return options.map(function (option, i) {
+        return Object.assign({}, option, { disabled: disable && i > 0 });
+      });
+    },
+
+    // youth tables start in 1997, adult tables in 2000
+    update_slider_min: function (active_tab) {
+      return active_tab === "youth" ? 1997 : 2000;
+    },
+
+    // flash the "Updating..." alert whenever the selection changes
+    toggle_alert: function (years, provinces, is_open) {
+      if (years !== null && years !== undefined && provinces !== null && provinces !== undefined) {
+        return !is_open;
+      }
+      return is_open;
+    },
+
+    // the map's year slider covers the fiscal years of the selected range
+    update_map_years: function (years, year) {
+      const min = years[0];
+      const max = Math.max(years[0], years[1] - 1);
+      return [min, max, Math.min(Math.max(year, min), max)];
+    },
+
+    // play/pause the map: each timer tick moves the year slider one year on,
+    // until the last year of the range
+    play_map: function (n_clicks, n_intervals, paused, year, min, max) {
+      const no_update = window.dash_clientside.no_update;
+      const triggered = window.dash_clientside.callback_context.triggered;
+      const clicked = triggered.some(function (t) {
+        return t.prop_id === "map-play.n_clicks";
+      });
+      if (clicked && paused) {
+        return [false, "Pause", year >= max ? min : no_update];
+      }
+      if (clicked || year >= max) {
+        return [true, "Play", no_update];
+      }
+      return [no_update, no_update, year + 1];
+    },
+
+    // fire the callbacks of the default figures the page came without, once
+    // it has loaded, so the browser fetches them concurrently
+    load_figures: function (pending) {
+      const no_update = window.dash_clientside.no_update;
+      if (!pending || pending.length === 0) {
+        return no_update;
+      }
+      const outputs = window.dash_clientside.callback_context.outputs_list;
+      return outputs.map(function (output) {
+        return pending.includes(output.id.index) ? true : no_update;
+      });
+    },
+  },
+});
@@ -0,0 +1,318 @@
+import argparse
+import collections
+import datetime
+import functools
+import inspect
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.graph_objs as go
+import plotly.io as pio
+import plotly.subplots
+from pandas.core.groupby.generic import DataFrameGroupBy, SeriesGroupBy
+
+import cube
+import data_adult
+import data_youth
+import tables
+from controls import geo_list
+
+# Benchmark of the figure functions of data_adult and data_youth. Every public
+# function taking a template is run over a matrix of year windows, province
+# selections and rate / sex / supervision types, and each call is timed per
+# stage:
+#   load       tables from the registry (tables.get_table/get_years/get_cube/
+#              get_loaded)
+#   aggregate  groupby reductions, pivots and cube sums
+#   figure     plotly express, graph objects and subplots
+#   filter     the rest of the function: masks, selections, reshaping
+#   serialize  the figure's plotly JSON, as sent to the browser
+# A stage is charged for the outermost timed call only, e.g. the pandas work
+# plotly express does internally counts as figure time.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --baseline bench.json --threshold 1.25
+
+MODULES = [data_adult, data_youth]
+
+YEAR_WINDOWS = [(1997, 2022), (2000, 2010), (2017, 2022), (2015, 2016)]
+
+PROVINCES = {
+    "single": ["Ontario"],
+    "several": ["Alberta", "Ontario", "Quebec"],
+    "all": geo_list()[:1],
+}
+
+# values of the other figure function arguments, by argument name
+OPTIONS = {
+    "rate_type": ["Incarceration", "Probation"],
+    "sex": ["Male", "Female"],
+    "supervision_type": ["actual-in", "community supervision"],
+}
+
+STAGES = ["load", "filter", "aggregate", "figure", "serialize"]
+
+GROUPBY_METHODS = [
+    "agg", "aggregate", "apply", "count", "first", "last", "max", "mean",
+    "median", "min", "nunique", "size", "sum", "transform",
+]
+
+
+class StageTimer:
+    """Charges the time spent in wrapped callables to their stage"""
+
+    def __init__(self):
+        self.times = collections.Counter()
+        self._stage = None
+        self._patched = []
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+        timer = self
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            if timer._stage is not None:
+                return original(*args, **kwargs)
+            timer._stage = stage
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timer.times[stage] += time.perf_counter() - start
+                timer._stage = None
+
+        self._patched.append((owner, name, original, name in vars(owner)))
+        setattr(owner, name, timed)
+
+    def install(self):
+        for name in ["get_table", "get_years", "get_cube", "get_loaded"]:
+            self.wrap(tables, name, "load")
+
+        for cls in [DataFrameGroupBy, SeriesGroupBy]:
+            for name in GROUPBY_METHODS:
+                self.wrap(cls, name, "aggregate")
+        for owner, name in [
+            (pd.DataFrame, "pivot_table"),
+            (pd.DataFrame, "pivot"),
+            (pd.DataFrame, "value_counts"),
+            (pd.Series, "value_counts"),
+            (pd, "pivot_table"),
+            (pd, "crosstab"),
+            (cube.YearCube, "sum"),
+        ]:
+            self.wrap(owner, name, "aggregate")
+
+        for name in px.__all__:
+            if inspect.isfunction(getattr(px, name)):
+                self.wrap(px, name, "figure")
+        for module in [plotly.subplots] + MODULES:
+            if hasattr(module, "make_subplots"):
+                self.wrap(module, "make_subplots", "figure")
+        # graph objects are wrapped in place so isinstance checks still work
+        for namespace in [go, go.layout]:
+            for name in dir(namespace):
+                cls = getattr(namespace, name)
+                if isinstance(cls, type) and "__init__" in vars(cls):
+                    self.wrap(cls, "__init__", "figure")
+        for name in dir(go.Figure):
+            if name.startswith(("add_", "update_", "for_each_")):
+                self.wrap(go.Figure, name, "figure")
+
+    def restore(self):
+        for owner, name, original, own in reversed(self._patched):
+            if own:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self._patched = []
+
+    def reset(self):
+        self.times.clear()
+
+
+def figure_functions(modules=MODULES):
+    """Public functions of the modules that build a figure (take a template)"""
+    for module in modules:
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ != module.__name__ or name.startswith("_"):
+                continue
+            if "template" in inspect.signature(func).parameters:
+                yield f"{module.__name__}.{name}", func
+
+
+def cases(func):
+    """(case name, keyword arguments) for every point of the matrix that
+    applies to the function"""
+    params = inspect.signature(func).parameters
+    options = [name for name in OPTIONS if name in params]
+    selections = list(PROVINCES) if "geos" in params else [None]
+    for (start, end), selection, values in itertools.product(
+        YEAR_WINDOWS, selections, itertools.product(*(OPTIONS[o] for o in options))
+    ):
+        kwargs = dict(start_year=start, end_year=end, template=None)
+        kwargs.update(zip(options, values))
+        parts = [f"{start}-{end}"]
+        if selection is not None:
+            kwargs["geos"] = PROVINCES[selection]
+            parts.append(selection)
+        yield "/".join(parts + list(values)), kwargs
+
+
+def run_case(timer, func, kwargs):
+    """Stage times in milliseconds of one call"""
+    timer.reset()
+    start = time.perf_counter()
+    fig = func(**kwargs)
+    total = time.perf_counter() - start
+    times = dict(timer.times)
+    times["filter"] = total - sum(times.values())
+
+    start = time.perf_counter()
+    if hasattr(fig, "to_plotly_json"):
+        pio.to_json(fig, validate=False)
+    times["serialize"] = time.perf_counter() - start
+    times["total"] = total + times["serialize"]
+    return {stage: value * 1000 for stage, value in times.items()}
+
+
+def run(repeat=5, only=None, cold=False):
+    """
+    Benchmark every figure function over its cases: median stage times of
+    `repeat` calls after a warm-up call. With cold=True the table registry is
+    emptied before each case so the timings include reading the tables.
+    """
+    results = {}
+    timer = StageTimer()
+    timer.install()
+    try:
+        for name, func in figure_functions():
+            if only and only not in name:
+                continue
+            results[name] = {}
+            for case, kwargs in cases(func):
+                try:
+                    if not cold:
+                        func(**kwargs)
+                    runs = []
+                    for _ in range(repeat):
+                        if cold:
+                            tables.invalidate()
+                        runs.append(run_case(timer, func, kwargs))
+                except Exception as e:
+                    results[name][case] = {"error": f"{type(e).__name__}: {e}"}
+                    continue
+                results[name][case] = {
+                    stage: round(statistics.median(r.get(stage, 0) for r in runs), 3)
+                    for stage in STAGES + ["total"]
+                }
+                print(f"{name} {case}: {results[name][case]['total']:.1f} ms", file=sys.stderr)
+    finally:
+        timer.restore()
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "plotly": plotly.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "cold": cold,
+        },
+        "results": results,
+    }
+
+
+def summary(report):
+    """One line per function: median over its cases of each stage"""
+    lines = [f"{'function':68} " + " ".join(f"{s:>9}" for s in STAGES + ["total"])]
+    for name, results in report["results"].items():
+        ok = [r for r in results.values() if "error" not in r]
+        if not ok:
+            errors = {r["error"] for r in results.values()}
+            lines.append(f"{name:68} error: {'; '.join(sorted(errors))}")
+            continue
+        medians = [statistics.median(r[s] for r in ok) for s in STAGES + ["total"]]
+        lines.append(f"{name:68} " + " ".join(f"{m:9.2f}" for m in medians))
+    return "\n".join(lines)
+
+
+def compare(report, baseline, threshold=1.2, min_delta=2.0, stage_thresholds=None):
+    """
+    Cases slower than the baseline: total (or a stage with its own threshold)
+    above threshold x baseline and more than min_delta ms slower, so noise on
+    sub-millisecond stages is not reported.
+    """
+    checks = dict(stage_thresholds or {})
+    checks["total"] = threshold
+    regressions = []
+    for name, results in report["results"].items():
+        for case, current in results.items():
+            previous = baseline["results"].get(name, {}).get(case)
+            if previous is None or "error" in current or "error" in previous:
+                continue
+            for stage, limit in checks.items():
+                old, new = previous.get(stage, 0), current.get(stage, 0)
+                if new - old > min_delta and new > old * limit:
+                    regressions.append((name, case, stage, old, new))
+    return regressions
+
+
+def parse_stage_threshold(text):
+    stage, _, value = text.partition("=")
+    if stage not in STAGES:
+        raise argparse.ArgumentTypeError(f"unknown stage {stage!r}")
+    return stage, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the figure functions")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run the functions whose name contains this")
+    parser.add_argument("--cold", action="store_true", help="reload the tables for every case")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --output")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--min-delta", type=float, default=2.0, help="milliseconds")
+    parser.add_argument(
+        "--stage-threshold",
+        type=parse_stage_threshold,
+        action="append",
+        default=[],
+        metavar="STAGE=RATIO",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.only, args.cold)
+    print(summary(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            report, baseline, args.threshold, args.min_delta, dict(args.stage_threshold)
+        )
+        for name, case, stage, old, new in regressions:
+            print(f"REGRESSION {name} {case} {stage}: {old:.2f} -> {new:.2f} ms")
+        if regressions:
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Usage: python benchmark.py --only adult --repeat 3 --output bench.json
+# Usage: python benchmark.py --baseline bench.json --stage-threshold figure=1.5
@@ -1,25 +1,9 @@
-import pandas as pd
+import geography
+
 
 # Function to get the list of provinces
 def geo_list():
-    geo_list = [
-        "All Provinces and territories",
-        "Alberta",
-        "British Columbia",
-        "Manitoba",
-        "New Brunswick",
-        "Newfoundland and Labrador",
-        "Northwest Territories",
-        "Northwest Territories including Nunavut",
-        "Nova Scotia",
-        "Nunavut",
-        "Ontario",
-        "Prince Edward Island",
-        "Quebec",
-        "Saskatchewan",
-        "Yukon",
-    ]
-    return geo_list
+    return list(geography.GEOS)
 
 
 # Function to get the list of years
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+# Precomputed aggregates for "sum VALUE over a year range grouped by some
+# dimensions". A cube holds VALUE summed for every fiscal year and every
+# combination of its dimension labels, accumulated along the year axis, so the
+# total for any year window is the difference of two slices.
+
+
+class YearCube:
+    def __init__(self, table, dims, relabel=None, value="VALUE"):
+        """
+        Build the cube from a tables.Table (rows sorted by fiscal year).
+        relabel maps a dimension to {label: merged label}, e.g. to fold the two
+        Ontario ministries into "Ontario" before summing.
+        """
+        df = table.df
+        self.dims = list(dims)
+
+        self.start_years, periods = np.unique(table.start_years, return_inverse=True)
+        self.end_years = np.zeros(len(self.start_years), dtype=int)
+        self.end_years[periods] = table.end_years
+
+        keep = np.ones(len(df), dtype=bool)
+        self.labels = []
+        codes = []
+        for dim in self.dims:
+            column = df[dim]
+            if relabel and dim in relabel:
+                # per label, not per row, for a categorical column; a
+                # categorical cannot take merged labels in place
+                merged = relabel[dim]
+                column = column.map(lambda label: merged.get(label, label))
+            dim_codes, dim_labels = pd.factorize(column, sort=True)
+            keep &= dim_codes >= 0  # groupby drops missing labels too
+            codes.append(dim_codes)
+            self.labels.append(dim_labels)
+
+        index = (periods[keep],) + tuple(c[keep] for c in codes)
+        values = df[value].to_numpy(dtype=float)[keep]
+        shape = (len(self.start_years),) + tuple(len(l) for l in self.labels)
+
+        sums = np.zeros(shape)
+        np.add.at(sums, index, np.nan_to_num(values))
+        # number of rows per cell, to tell empty cells from cells summing to 0
+        counts = np.zeros(shape, dtype=np.int64)
+        np.add.at(counts, index, 1)
+
+        # prefix sums along the year axis with a leading row of zeros
+        pad = [(1, 0)] + [(0, 0)] * len(self.dims)
+        self._sums = np.pad(sums.cumsum(axis=0), pad)
+        self._counts = np.pad(counts.cumsum(axis=0), pad)
+
+    def window(self, start_year, end_year):
+        """VALUE sums and row counts per cell for the fiscal years within
+        start_year and end_year (same rule as tables.get_years)"""
+        lo = np.searchsorted(self.start_years, start_year, side="left")
+        hi = max(lo, np.searchsorted(self.end_years, end_year, side="right"))
+        return self._sums[hi] - self._sums[lo], self._counts[hi] - self._counts[lo]
+
+    def sum(self, start_year, end_year, by, where=None, exclude=None):
+        """
+        Sum VALUE over the year window grouped by the dimensions in `by`.
+
+        where/exclude map a dimension to the labels to keep/drop. Returns the
+        same long frame as df.groupby(by)["VALUE"].sum().reset_index() would
+        for the filtered rows.
+        """
+        sums, counts = self.window(start_year, end_year)
+        labels = {}
+        for axis, dim in enumerate(self.dims):
+            keep = np.ones(len(self.labels[axis]), dtype=bool)
+            if where and dim in where:
+                keep &= self.labels[axis].isin(where[dim])
+            if exclude and dim in exclude:
+                keep &= ~self.labels[axis].isin(exclude[dim])
+            positions = np.flatnonzero(keep)
+            sums = sums.take(positions, axis=axis)
+            counts = counts.take(positions, axis=axis)
+            labels[dim] = self.labels[axis][positions]
+
+        # collapse the dimensions that are not grouped on, then order the rest
+        # as requested
+        other = tuple(i for i, dim in enumerate(self.dims) if dim not in by)
+        kept = [dim for dim in self.dims if dim in by]
+        order = [kept.index(dim) for dim in by]
+        sums = sums.sum(axis=other).transpose(order)
+        counts = counts.sum(axis=other).transpose(order)
+
+        cells = np.nonzero(counts)
+        data = {dim: labels[dim][cells[i]] for i, dim in enumerate(by)}
+        data["VALUE"] = sums[cells]
+        return pd.DataFrame(data)
+
+
+# Usage: YearCube(table, ["GEO", "Age group"]).sum(2000, 2010, by=["GEO"])
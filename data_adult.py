@@ -3,53 +3,78 @@ import plotly.express as px
 import pandas as pd
 from plotly.subplots import make_subplots
 
+import geo
+import geography
+import tables
+from query import Query, run
+
+# rate types of the map: (supervision row of table 35100154, colour bar label)
+RATE_TYPES = {
+    "Incarceration": ("Incarceration rates per 100,000 adults", "Incarceration rate"),
+    "Probation": ("Probation rates per 100,000 adults", "Probation rate"),
+}
+
+
+def adults_rates_years(start_year, end_year):
+    """Fiscal years (by start year) the map can show for a year range"""
+    df = run(Query("adult/35100154", (start_year, end_year), columns=["REF_DATE"]))
+    return sorted({int(ref_date[:4]) for ref_date in df["REF_DATE"].unique()})
+
+
+def adults_rates_frame(rate_type, year):
+    """
+    Provincial rates of one fiscal year, the frame the map shows for that
+    year. Computed once per rate type, year and version of the table; do not
+    modify the result.
+    """
+
+    def build():
+        data = run(
+            Query(
+                "adult/35100154",
+                (year, year + 1),
+                where={"Custodial and community supervision": [RATE_TYPES[rate_type][0]]},
+                exclude={"GEO": [geography.TOTAL]},
+                columns=["REF_DATE", "GEO", "VALUE"],
+            )
+        )
+        return data.reset_index(drop=True)
 
-import pandas as pd
-import plotly.express as px
-
-import pandas as pd
-import plotly.express as px
-
+    return tables.get_derived("adult/35100154", ("rates", rate_type, year), build)
 
-def adults_rates_geomap(start_year, end_year, template, rate_type):
-    # load data
-    df = pd.read_csv("./dataset/adult/35100154.csv")
 
-    data = df[df["GEO"] != "Provinces and Territories"]
+def adults_rates_geomap(start_year, end_year, template, rate_type, year=None):
+    """
+    Map of the rates of one fiscal year (the first of the range by default),
+    coloured on the scale of the whole range so years compare when the page
+    steps through them. Only the frame on display is sent to the browser.
+    """
+    if rate_type not in RATE_TYPES:
+        return "Error: Invalid rate type. Please enter 'Incarceration' or 'Probation'."
+    color_label = RATE_TYPES[rate_type][1]
 
-    data = data[
-        (data["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (data["REF_DATE"].str[:4].astype(int) <= end_year)
-    ]
+    years = adults_rates_years(start_year, end_year)
+    if year not in years:
+        year = years[0] if years else start_year
+    frame = adults_rates_frame(rate_type, year)
+    title = f"{rate_type} rate by province, {year}/{year + 1}"
 
-    # filter the data to include only the specified rate type
-    if rate_type == "Incarceration":
-        data = data[
-            data["Custodial and community supervision"]
-            == "Incarceration rates per 100,000 adults"
-        ]
-        title = "Incarceration rate by province over time"
-        color_label = "Incarceration rate"
-    elif rate_type == "Probation":
-        data = data[
-            data["Custodial and community supervision"]
-            == "Probation rates per 100,000 adults"
-        ]
-        title = "Probation rate by province over time"
-        color_label = "Probation rate"
-    else:
-        return "Error: Invalid rate type. Please enter 'Incarceration' or 'Probation'."
+    frames = [adults_rates_frame(rate_type, y) for y in years]
+    values = pd.concat([frame["VALUE"] for frame in frames]) if frames else None
+    range_color = None
+    if values is not None and values.notna().any():
+        range_color = (values.min(), values.max())
 
     # create the map
     fig = px.choropleth(
-        data,
-        geojson="https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/canada.geojson",
+        frame,
+        geojson=geo.geojson_url(),
         locations="GEO",
         featureidkey="properties.name",
         color="VALUE",
-        animation_frame="REF_DATE",
-        hover_data=["GEO", "VALUE"],
+        hover_data=["REF_DATE", "GEO", "VALUE"],
         labels={"VALUE": color_label},
+        range_color=range_color,
         title=title,
         locationmode="geojson-id",
         scope="north america",
@@ -67,33 +92,28 @@ def adults_rates_geomap(start_year, end_year, template, rate_type):
     return fig
 
 
-# Usage: adults_rates_geomap(2005,2022,'Incarceration')
-# Usage: adults_rates_geomap(2005,2022,'Probation')
+# Usage: adults_rates_geomap(2005, 2022, None, 'Incarceration')
+# Usage: adults_rates_geomap(2005, 2022, None, 'Probation', 2010)
 
 
 def adult_admissions_3dtrend(start_year, end_year, template, geos=None):
 
-    df = pd.read_csv("./dataset/adult/35100014.csv")
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-
+    where = {
+        "Custodial and community admissions": [
+            "Total custodial admissions",
+            "Total community admissions",
+        ]
+    }
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-
-    df_filtered = df[
-        df["Custodial and community admissions"].isin(
-            ["Total custodial admissions", "Total community admissions"]
+        where["GEO"] = geos
+
+    df_grouped = run(
+        Query(
+            "adult/35100014",
+            (start_year, end_year),
+            where=where,
+            by=["REF_DATE", "Custodial and community admissions", "GEO"],
         )
-    ]
-
-    df_grouped = (
-        df_filtered.groupby(["REF_DATE", "Custodial and community admissions", "GEO"])[
-            "VALUE"
-        ]
-        .sum()
-        .reset_index()
     )
 
     fig = px.scatter_3d(
@@ -116,23 +136,20 @@ def adult_admissions_3dtrend(start_year, end_year, template, geos=None):
 
 def adult_custody_admissions_age_group(start_year, end_year, template, geos=None):
 
-    df = pd.read_csv("./dataset/adult/35100017.csv")
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-    df = df[~df["Age group"].isin(["Median age on admission"])]
+    median = ["Median age on admission"]
 
-    if geos is not None:
-        df = df[df["GEO"].isin(geos)]  # example goes: ['Manitoba','Ontario','Alberta']
-    else:
-        geos = ["All Provinces and territories"]
-        df = df[df["GEO"] == "Provinces and territories"]
-
-    # Filter the data to only include the relevant Custodial admissions and GEO values
-    df_filtered = df[df["Custodial admissions"] == "Total, custodial admissions"]
-    grouped = (
-        df_filtered.groupby(["GEO", "Age group"]).agg({"VALUE": "sum"}).reset_index()
+    if geos is None:
+        geos = [geography.TOTAL]  # or e.g. ['Manitoba','Ontario','Alberta']
+
+    # Sum the total custodial admissions in the year range by GEO and age group
+    grouped = run(
+        Query(
+            "adult/35100017",
+            (start_year, end_year),
+            where={"GEO": geos, "Custodial admissions": ["Total, custodial admissions"]},
+            exclude={"Age group": median},
+            by=["GEO", "Age group"],
+        )
     )
 
     # Create the bar chart using px.bar
@@ -147,21 +164,18 @@ def adult_custody_admissions_age_group(start_year, end_year, template, geos=None
 
     fig1.update_layout(title="Adult admissions to correctional services by age group")
 
-    # Filter the data to only include the relevant Custodial admissions values
-    df_filtered = df[
-        df["Custodial admissions"].isin(
-            ["Sentenced", "Remand", "Other custodial statuses"]
+    # Sum the relevant Custodial admissions values by GEO
+    df_grouped = run(
+        Query(
+            "adult/35100017",
+            (start_year, end_year),
+            where={
+                "GEO": geos,
+                "Custodial admissions": ["Sentenced", "Remand", "Other custodial statuses"],
+            },
+            exclude={"Age group": median + ["Total, custodial admissions by age group"]},
+            by=["GEO", "Custodial admissions"],
         )
-    ]
-
-    # Group the data by GEO and Custodial admissions and sum the values
-    df_grouped = (
-        df_filtered[
-            df_filtered["Age group"] != "Total, custodial admissions by age group"
-        ]
-        .groupby(["GEO", "Custodial admissions"])["VALUE"]
-        .sum()
-        .reset_index()
     )
 
     # Create a pie chart of the Custodial admissions for Provinces and territories
@@ -208,16 +222,10 @@ def adult_custody_admissions_age_group(start_year, end_year, template, geos=None
 
 
 def adult_custody_gender_heatmap(sex, start_year, end_year, template, geos=None):
-    df = pd.read_csv("./dataset/adult/35100015.csv")
-    df = df[df["Custodial admissions"] == "Total, custodial admissions"]
-    #     df = df[~df['GEO'].isin(['Provinces and territories'])]
+    where = {"Custodial admissions": ["Total, custodial admissions"], "Sex": [sex]}
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-    df = df[df["Sex"] == sex]
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[:4].astype(int) <= end_year)
-    ]
+        where["GEO"] = geos
+    df = run(Query("adult/35100015", (start_year, end_year), where=where))
     fig = px.density_heatmap(
         df,
         x="REF_DATE",
@@ -240,31 +248,29 @@ def adult_custody_gender_heatmap(sex, start_year, end_year, template, geos=None)
 
 
 def adult_indigenous_vs_nonindigenous(start_year, end_year, template, geos=None):
-    df = pd.read_csv("./dataset/adult/35100016.csv")
-
     # Filter data based on the input parameters
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-
+    where = {
+        "Custodial admissions": ["Total, custodial admissions"],
+        "Indigenous identity": ["Indigenous identity", "Non-Indigenous identity"],
+    }
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-
-    df = df[df["Custodial admissions"] == "Total, custodial admissions"]
-    df = df[
-        df["Indigenous identity"].isin(
-            ["Indigenous identity", "Non-Indigenous identity"]
+        where["GEO"] = geos
+
+    # Sum the admissions in the year range by GEO and Indigenous identity
+    df = run(
+        Query(
+            "adult/35100016",
+            (start_year, end_year),
+            where=where,
+            by=["GEO", "Indigenous identity"],
         )
-    ]
+    )
 
     # Pivot the data to create separate columns for Indigenous and Non-Indigenous admissions
-    df = df.pivot_table(
-        index=["GEO"], columns=["Indigenous identity"], values=["VALUE"], aggfunc=sum
-    )
+    df = df.pivot(index="GEO", columns="Indigenous identity", values="VALUE")
 
     # Rename the columns and reset the index
-    df.columns = [" ".join(col).strip() for col in df.columns.values]
+    df.columns = [f"VALUE {col}" for col in df.columns]
     df = df.reset_index()
 
     # Calculate the total number of admissions for each GEO
@@ -295,36 +301,23 @@ def adult_indigenous_vs_nonindigenous(start_year, end_year, template, geos=None)
 
 
 def adult_sentence_length_by_sex(start_year, end_year, template, geos=None):
-    df = pd.read_csv("./dataset/adult/35100018.csv")
-
-    # Filter data based on the input parameters
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-    df = df[df["Sentence length ordered"] != "Total, sentence length ordered"]
-
-    if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-    else:
-        geos = ["All Provinces and territories"]
-        df = df[df["GEO"] == "Provinces and territories"]
+    if geos is None:
+        geos = [geography.TOTAL]
+
+    # Sum the admissions in the year range by sentence length and sex
+    df = run(
+        Query(
+            "adult/35100018",
+            (start_year, end_year),
+            where={"GEO": geos},
+            exclude={"Sentence length ordered": ["Total, sentence length ordered"]},
+            by=["Sentence length ordered", "Sex"],
+        )
+    )
 
     # Pivot the data to create separate columns for Male, Female, and Total admissions
-    df = df.pivot_table(
-        index=["Sentence length ordered"],
-        columns=["Sex"],
-        values=["VALUE"],
-        aggfunc=sum,
-    )
-    df.columns = [" ".join(col).strip() for col in df.columns.values]
-    df = df.rename(
-        columns={
-            "VALUE Male": "Male",
-            "VALUE Female": "Female",
-            "VALUE Total, custodial admission by sex": "Total",
-        }
-    )
+    df = df.pivot(index="Sentence length ordered", columns="Sex", values="VALUE")
+    df = df.rename(columns={"Total, custodial admission by sex": "Total"})
 
     # Reset the index
     df = df.reset_index()
@@ -1,8 +1,10 @@
-import pandas as pd
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objs as go
 
+import geography
+from query import Query, run
+
 # Plots we can generate from this dataset:
 
 # - Pie chart of Custodial and community supervision actual-in count with geo and date filter
@@ -22,21 +24,18 @@ def youth_in_correctional_services(
     start_year, end_year, template, supervision_type="actual-in", geos=None
 ):
     """Pie chart of Custodial and community supervision actual-in count/community supervision count with GEOs and date filter"""
-    df = pd.read_csv("./dataset/youth/35100003.csv")
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-
+    query = Query(
+        "youth/35100003",
+        (start_year, end_year),
+        contains={"Custodial and community supervision": supervision_type},
+    )
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
+        query.where["GEO"] = geos
     else:
-        geos = ["All Provinces and territories"]
-        df = df[~df["GEO"].isin(["Provinces and Territories"])]
+        geos = [geography.TOTAL]
+        query.exclude["GEO"] = [geography.TOTAL]
 
-    df_actual_in = df[
-        df["Custodial and community supervision"].str.contains(supervision_type)
-    ]
+    df_actual_in = run(query)
 
     fig = px.bar(
         df_actual_in,
@@ -119,31 +118,22 @@ def youth_in_correctional_services(
 def youth_in_correctional_services_trend_3d(start_year, end_year,template,rate_type="Incarceration", geos=None
 ):
     """3D Line chart of Incarceration or Probation rate with geo and date filter"""
-    data = pd.read_csv("./dataset/youth/35100003.csv")
-    data = data[
-        (data["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (data["REF_DATE"].str[:4].astype(int) <= end_year)
-    ]
     # Filter data for the specified rate type
     if rate_type == "Incarceration":
-        filtered_data = data[
-            data["Custodial and community supervision"]
-            == "Incarceration rates per 10,000 young persons"
-        ]
+        supervision = "Incarceration rates per 10,000 young persons"
     elif rate_type == "Probation":
-        filtered_data = data[
-            data["Custodial and community supervision"]
-            == "Probation rate per 10,000 young persons"
-        ]
+        supervision = "Probation rate per 10,000 young persons"
     else:
         print("Invalid rate type")
         return None
+    where = {"Custodial and community supervision": [supervision]}
+    if geos is not None:
+        where["GEO"] = geos
 
     # Drop rows with missing values
-    filtered_data = filtered_data.dropna(subset=["VALUE"])
-
-    if geos is not None:
-        filtered_data = filtered_data[filtered_data["GEO"].isin(geos)]
+    filtered_data = run(
+        Query("youth/35100003", (start_year, end_year), where=where, dropna=True)
+    )
 
     # Create a 3D line graph with trend lines for each GEO
     fig = go.Figure()
@@ -186,25 +176,16 @@ def youth_commencing_correctional_services(start_year, end_year, template, geos=
     Pie chart and a bar chart showing the distribution of initial entry status and community sentences
     for youth commencing correctional services in the specified time period and geographic regions.
     """
-    # Load dataset
-    df = pd.read_csv("./dataset/youth/35100004.csv")
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
+    query = Query(
+        "youth/35100004",
+        (start_year, end_year),
+        by=["GEO", "Initial entry status"],
+    )
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
+        query.where["GEO"] = geos
     else:
-        geos = ["All Provinces and territories"]
-        df = df[~df["GEO"].isin(["Provinces and territories"])]
-
-    df["GEO"] = df["GEO"].replace(
-        [
-            "Ontario, Ministry of Children and Youth Services (MCYS)",
-            "Ontario, Ministry of Community Safety and Correctional Services (MCSCS)",
-        ],
-        "Ontario",
-    )
+        geos = [geography.TOTAL]
+        query.exclude["GEO"] = [geography.TOTAL]
 
     # Filter relevant data for pie chart
     relevant_statuses_pie = [
@@ -218,8 +199,8 @@ def youth_commencing_correctional_services(start_year, end_year, template, geos=
         "Total community sentences",
     ]
 
-    df_pie = df[df["Initial entry status"].isin(relevant_statuses_pie)]
-    df_grouped_pie = df_pie.groupby(["GEO", "Initial entry status"]).sum().reset_index()
+    query.where["Initial entry status"] = relevant_statuses_pie
+    df_grouped_pie = run(query)
 
     # Filter relevant data for bar chart
     relevant_statuses_bar = [
@@ -229,8 +210,8 @@ def youth_commencing_correctional_services(start_year, end_year, template, geos=
         "Other community sentences",
     ]
 
-    df_bar = df[df["Initial entry status"].isin(relevant_statuses_bar)]
-    df_grouped_bar = df_bar.groupby(["GEO", "Initial entry status"]).sum().reset_index()
+    query.where["Initial entry status"] = relevant_statuses_bar
+    df_grouped_bar = run(query)
 
     # Create pie chart
     fig_pie = px.pie(
@@ -288,21 +269,6 @@ def youth_admissions_and_releases_to_correctional_services(
     start_year, end_year, template, geos=None
 ):
     """Comparison chart for youth admission and release to correctional services"""
-    # Read the data
-    df = pd.read_csv("./dataset/youth/35100005.csv")
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-    if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-    else:
-        geos = ["All Provinces and territories"]
-        df = df[~df["GEO"].isin(["Provinces and territories"])]
-
-    # Filter the data based on 'Youth admissions' and 'Youth releases' only
-    df = df[df["Admissions and releases"].isin(["Youth admissions", "Youth releases"])]
-
     # Filter the data based on the relevant correctional service categories
     relevant_categories = [
         "Pre-trial detention",
@@ -314,14 +280,34 @@ def youth_admissions_and_releases_to_correctional_services(
         "Young Offenders Act (YOA) (open)",
         "Total community sentences",
     ]
-    df = df[df["Correctional services"].isin(relevant_categories)]
+    # and on 'Youth admissions' and 'Youth releases' only
+    query = Query(
+        "youth/35100005",
+        (start_year, end_year),
+        where={
+            "Admissions and releases": ["Youth admissions", "Youth releases"],
+            "Correctional services": relevant_categories,
+        },
+    )
+    if geos is not None:
+        query.where["GEO"] = geos
+    else:
+        geos = [geography.TOTAL]
+        query.exclude["GEO"] = [geography.TOTAL]
+    df = run(query)
 
     # Pivot the data to create separate columns for 'Youth admissions' and 'Youth releases'
-    df = df.pivot(
-        index=["Correctional services", "REF_DATE", "GEO"],
-        columns="Admissions and releases",
-        values="VALUE",
-    ).reset_index()
+    # (grouping on the observed labels: pivot on several categorical columns
+    # does not line the values up with the index)
+    df = (
+        df.groupby(
+            ["Correctional services", "REF_DATE", "GEO", "Admissions and releases"],
+            observed=True,
+        )["VALUE"]
+        .first()
+        .unstack()
+        .reset_index()
+    )
 
     # Create the bar plot
     fig = px.bar(
@@ -364,27 +350,23 @@ def youth_admissions_and_releases_to_correctional_services(
 def youth_gender_trends_and_pie(start_year, end_year, template, geos=None):
     """Admissions to correctional services by gender (trend and distribution)"""
     # print('youth_gender_trends_and_pie:',start_year, end_year, template, geos)
-    df = pd.read_csv("./dataset/youth/35100006.csv", low_memory=False)
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-    if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-    else:
-        df = df[df["GEO"] == "Provinces and territories"]
-
     colors = ["blue", "red", "green"]
 
-    # filter the dataframe for the required values
-    df_filtered = df[
-        (df["Correctional services"] == "Total correctional services")
-        & (df["Age at time of admission"] == "Total, admissions by age")
-        & (df["Sex"] != "Sex unknown")
-    ]
-
-    # group by year and sex and sum the value column
-    df_grouped = df_filtered.groupby(["REF_DATE", "Sex"])["VALUE"].sum().reset_index()
+    # filter the table for the required values, group by year and sex and sum
+    # the value column
+    df_grouped = run(
+        Query(
+            "youth/35100006",
+            (start_year, end_year),
+            where={
+                "GEO": geos if geos is not None else [geography.TOTAL],
+                "Correctional services": ["Total correctional services"],
+                "Age at time of admission": ["Total, admissions by age"],
+            },
+            exclude={"Sex": ["Sex unknown"]},
+            by=["REF_DATE", "Sex"],
+        )
+    )
 
     # pivot the dataframe to get the values for each gender
     df_pivot = df_grouped.pivot(index="REF_DATE", columns="Sex", values="VALUE")
@@ -416,7 +398,7 @@ def youth_gender_trends_and_pie(start_year, end_year, template, geos=None):
     )
 
     # create the pie chart
-    gender_counts = df_filtered.groupby("Sex")["VALUE"].sum()
+    gender_counts = df_grouped.groupby("Sex", observed=True)["VALUE"].sum()
     fig2 = go.Figure(
         data=[go.Pie(labels=gender_counts.index, values=gender_counts.values)]
     )
@@ -455,34 +437,21 @@ def youth_gender_trends_and_pie(start_year, end_year, template, geos=None):
 
 def youth_age_by_geo(start_year, end_year, template, geos=None):
     """Admissions to correctional services by age"""
-    df = pd.read_csv("./dataset/youth/35100006.csv", low_memory=False)
-    df["GEO"] = df["GEO"].replace(
-        [
-            "Ontario, Ministry of Children and Youth Services (MCYS)",
-            "Ontario, Ministry of Community Safety and Correctional Services (MCSCS)",
-        ],
-        "Ontario",
-    )
-
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
+    where = {
+        "Correctional services": ["Total correctional services"],
+        "Sex": ["Total, admissions by sex"],
+    }
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-
-    df_filtered = df[
-        (df["Correctional services"] == "Total correctional services")
-        & (df["Sex"] == "Total, admissions by sex")
-    ]
-    df_filtered = df_filtered[
-        ~df_filtered["Age at time of admission"].isin(["Total, admissions by age"])
-    ]
-
-    grouped = (
-        df_filtered.groupby(["GEO", "Age at time of admission"])
-        .agg({"VALUE": "sum"})
-        .reset_index()
+        where["GEO"] = geos
+
+    grouped = run(
+        Query(
+            "youth/35100006",
+            (start_year, end_year),
+            where=where,
+            exclude={"Age at time of admission": ["Total, admissions by age"]},
+            by=["GEO", "Age at time of admission"],
+        )
     )
 
     fig = px.bar(
@@ -504,40 +473,30 @@ def youth_age_by_geo(start_year, end_year, template, geos=None):
 
 
 def youth_indigenous_vs_nonindigenous(start_year, end_year, template, geos=None):
-    df = pd.read_csv("./dataset/youth/35100007.csv", low_memory=False)
-
     # Filter data based on the input parameters
-    df = df[
-        (df["REF_DATE"].str[:4].astype(int) >= start_year)
-        & (df["REF_DATE"].str[5:].astype(int) <= end_year)
-    ]
-
+    where = {
+        "Sex": ["Total, admissions by sex"],
+        "Correctional services": ["Total correctional services"],
+        "Indigenous identity": ["Indigenous identity", "Non-Indigenous identity"],
+    }
     if geos is not None:
-        df = df[df["GEO"].isin(geos)]
-
-    df["GEO"] = df["GEO"].replace(
-        [
-            "Ontario, Ministry of Children and Youth Services (MCYS)",
-            "Ontario, Ministry of Community Safety and Correctional Services (MCSCS)",
-        ],
-        "Ontario",
-    )
-
-    df = df[df["Sex"] == "Total, admissions by sex"]
-    df = df[df["Correctional services"] == "Total correctional services"]
-    df = df[
-        df["Indigenous identity"].isin(
-            ["Indigenous identity", "Non-Indigenous identity"]
+        where["GEO"] = geos
+
+    # Sum the admissions in the year range by GEO and Indigenous identity
+    df = run(
+        Query(
+            "youth/35100007",
+            (start_year, end_year),
+            where=where,
+            by=["GEO", "Indigenous identity"],
         )
-    ]
+    )
 
     # Pivot the data to create separate columns for Indigenous and Non-Indigenous admissions
-    df = df.pivot_table(
-        index=["GEO"], columns=["Indigenous identity"], values=["VALUE"], aggfunc=sum
-    )
+    df = df.pivot(index="GEO", columns="Indigenous identity", values="VALUE")
 
     # Rename the columns and reset the index
-    df.columns = [" ".join(col).strip() for col in df.columns.values]
+    df.columns = [f"VALUE {col}" for col in df.columns]
     df = df.reset_index()
 
     # Calculate the total number of admissions for each GEO
@@ -0,0 +1,251 @@
+import collections
+import functools
+import json
+import numbers
+import os
+import threading
+
+import plotly.io as pio
+
+import profiling
+import shared_cache
+
+# Memoization layer for the data_adult / data_youth figure functions. Figures
+# are stored as their plotly JSON (a plain dict, which dcc.Graph accepts as is)
+# in an LRU cache bounded by the total size of that JSON. Behind it, a shared
+# backend (see shared_cache.py) holds the JSON for every worker on the node, so
+# a figure is computed once per node rather than once per process.
+#
+# Every figure records the version of each table it was computed from (see
+# tables.snapshot) and is only served while those tables are unchanged, so a
+# reloaded table invalidates the figures built on it and no others.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# misses are misses of the in-process cache; shared_hits of them were found in
+# the shared backend
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "entries", "bytes", "max_bytes", "shared_hits"]
+)
+
+
+def normalize(value):
+    """
+    Normalize a figure function argument for use in a cache key: province
+    lists become a sorted tuple without duplicates, year values plain ints.
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(set(value)))
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def normalize_args(args):
+    """Normalized arguments in a JSON-friendly form (tuples as lists)"""
+    return [list(v) if isinstance(v, tuple) else v for v in map(normalize, args)]
+
+
+def make_key(func, args):
+    return (func.__module__, func.__qualname__) + tuple(normalize(a) for a in args)
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+@functools.lru_cache(maxsize=None)
+def source_version():
+    """Stamp of every Python file of the app and of the plotly version: shared
+    entries outlive the process, so a deploy changing any code a figure goes
+    through (chart modules, queries, tables, geography...) must not reuse them"""
+    import plotly
+
+    files = sorted(name for name in os.listdir(ROOT) if name.endswith(".py"))
+    stamps = [(name, _file_stamp(os.path.join(ROOT, name))) for name in files]
+    return plotly.__version__, stamps
+
+
+def shared_key(key):
+    return shared_cache.hash_key(source_version(), *key)
+
+
+def is_current(versions):
+    """Whether the tables a figure was computed from are still the loaded
+    ones. tables is imported here rather than at the top: it brings pandas,
+    which fast startup defers until a figure is computed."""
+    import tables
+
+    return all(tables.version(name) == v for name, v in versions.items())
+
+
+def encode(figure_text, versions):
+    """Shared cache value: the table versions on the first line, then the
+    figure JSON"""
+    return (json.dumps(versions) + "\n" + figure_text).encode()
+
+
+def decode(data):
+    header, _, figure_text = data.partition(b"\n")
+    versions = {name: tuple(v) if v else v for name, v in json.loads(header).items()}
+    return versions, figure_text
+
+
+class FigureCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, shared=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        # figure requests per function name, hits and misses alike: each user
+        # interaction should request every affected figure exactly once
+        self.requests = collections.Counter()
+        self._entries = collections.OrderedDict()  # key -> (figure, size, versions)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, func, *args):
+        """
+        Return func(*args) as a figure dict, computing it only when no figure for
+        the same normalized arguments is cached. The function is called with
+        the normalized arguments so a cached figure never depends on the order
+        in which provinces were ticked.
+        """
+        with self._lock:
+            self.requests[func.__name__] += 1
+        return self._get(func, args, count=True)
+
+    def warm(self, func, *args):
+        """
+        Like get, without counting a request, hit or miss: for figures
+        computed ahead of the callback that will request them (see
+        app.compute_tab).
+        """
+        return self._get(func, args, count=False)
+
+    def _get(self, func, args, count):
+        key = make_key(func, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and is_current(entry[2]):
+            if count:
+                with self._lock:
+                    self.hits += 1
+            return entry[0]
+        if count:
+            with self._lock:
+                self.misses += 1
+
+        figure = self._get_shared(key)
+        if figure is not None:
+            if count:
+                with self._lock:
+                    self.shared_hits += 1
+            return figure
+
+        import tables
+
+        with tables.snapshot() as used:
+            fig = profiling.call(func.__qualname__, func, *normalize_args(args))
+            versions = {name: table.version for name, table in used.items()}
+        if not hasattr(fig, "to_plotly_json"):
+            # error messages and empty results are passed through uncached
+            return fig
+        text = pio.to_json(fig, validate=False)
+        figure = json.loads(text)
+        self._put(key, figure, len(text), versions)
+        if self.shared is not None:
+            self.shared.set(shared_key(key), encode(text, versions))
+        return figure
+
+    def _get_shared(self, key):
+        """Current figure computed by any worker, copied into this process'
+        cache"""
+        if self.shared is None:
+            return None
+        data = self.shared.get(shared_key(key))
+        if data is None:
+            return None
+        versions, text = decode(data)
+        if not is_current(versions):
+            return None
+        figure = json.loads(text)
+        self._put(key, figure, len(text), versions)
+        return figure
+
+    def peek(self, func, *args):
+        """Cached figure for these arguments or None, without computing it or
+        counting a hit"""
+        key = make_key(func, args)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and is_current(entry[2]):
+            return entry[0]
+        return self._get_shared(key)
+
+    def _put(self, key, figure, size, versions):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (figure, size, versions)
+            self._bytes += size
+            # evict least recently used figures until back within budget
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def info(self):
+        """Hit/miss counters and current size, to help size the budget"""
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                len(self._entries),
+                self._bytes,
+                self.max_bytes,
+                self.shared_hits,
+            )
+
+    def clear(self):
+        """Empty this process' cache and the shared one"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.shared is not None:
+            self.shared.clear()
+
+    def reset_counters(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.shared_hits = 0
+            self.requests.clear()
+
+
+# process-wide cache, sized with the FIGURE_CACHE_BYTES environment variable,
+# in front of the node-wide one configured by FIGURE_CACHE_URL
+figures = FigureCache(
+    int(os.environ.get("FIGURE_CACHE_BYTES", DEFAULT_MAX_BYTES)),
+    shared_cache.from_environ(),
+)
+
+
+def get_figure(func, *args):
+    """Cached func(*args), see FigureCache.get"""
+    return figures.get(func, *args)
+
+
+# Usage: get_figure(data_adult.adult_sentence_length_by_sex, 2000, 2010, "bootstrap", ["Yukon"])
+# Usage: figures.info()
@@ -0,0 +1,279 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import sys
+
+# Province and territory boundaries for the adult rates map. The vendored
+# source (dataset/geo/canada.geojson) is simplified at a few tolerances into
+# assets/geo/, which the app serves with long-lived cache headers; the map
+# loads the coarsest level that still looks right at the current zoom. The
+# source is the MIT-licensed Canada map of echarts-countries-js; its notice is
+# in dataset/geo/LICENSE and assets/geo/LICENSE.
+#
+# numpy is only needed to rebuild the levels, so it is imported there and the
+# app does not pay for it at startup.
+#
+# Rebuild the levels after changing the source or the tolerances:
+#   python geo.py
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, "dataset", "geo", "canada.geojson")
+ASSETS_DIR = os.path.join(ROOT, "assets", "geo")
+
+# Douglas-Peucker tolerance in degrees for each level, coarsest first
+LEVELS = {"low": 0.05, "medium": 0.01, "high": 0.002}
+
+# geo projection scale (zoom factor of the map) from which a level is used
+LEVEL_SCALES = [(1, "low"), (4, "medium"), (16, "high")]
+
+DEFAULT_LEVEL = "low"
+
+# coordinates are written with this many decimals (about 10 m)
+PRECISION = 4
+
+
+def level_path(level):
+    return os.path.join(ASSETS_DIR, f"canada-{level}.geojson")
+
+
+@functools.lru_cache(maxsize=None)
+def geojson_url(level=DEFAULT_LEVEL):
+    """
+    Asset url of a simplified level, versioned by a hash of its content so
+    browsers can cache it for good and still pick up a rebuilt file.
+    """
+    with open(level_path(level), "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:12]
+    return f"/assets/geo/canada-{level}.geojson?v={version}"
+
+
+def level_for_scale(scale):
+    """Simplification level to draw at a geo projection scale"""
+    level = DEFAULT_LEVEL
+    for min_scale, name in LEVEL_SCALES:
+        if scale >= min_scale:
+            level = name
+    return level
+
+
+def read_echarts(path):
+    """
+    Decode an ECharts map script (registerMap with UTF8Encoding, as shipped
+    by the echarts-countries-js maps) into a GeoJSON FeatureCollection.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    start = text.index("{", text.index("registerMap("))
+    data, _ = json.JSONDecoder().raw_decode(text, start)
+
+    def decode(ring, offsets):
+        x, y = offsets
+        points = []
+        for i in range(0, len(ring), 2):
+            dx, dy = ord(ring[i]) - 64, ord(ring[i + 1]) - 64
+            x += (dx >> 1) ^ -(dx & 1)
+            y += (dy >> 1) ^ -(dy & 1)
+            points.append([round(x / 1024, 6), round(y / 1024, 6)])
+        return points
+
+    features = []
+    for feature in data["features"]:
+        geometry = feature["geometry"]
+        polygons, offsets = geometry["coordinates"], geometry["encodeOffsets"]
+        if geometry["type"] == "Polygon":
+            polygons, offsets = [polygons], [offsets]
+        coordinates = [
+            [decode(ring, ring_offsets) for ring, ring_offsets in zip(p, o)]
+            for p, o in zip(polygons, offsets)
+        ]
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"name": feature["properties"]["name"]},
+                "geometry": {"type": "MultiPolygon", "coordinates": coordinates},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _douglas_peucker(points, tolerance):
+    """Indices of the points of an open line kept at this tolerance, end
+    points included"""
+    import numpy as np
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        inner = points[first + 1 : last]
+        ab = b - a
+        length = np.hypot(*ab)
+        if length == 0:
+            distances = np.hypot(*(inner - a).T)
+        else:
+            d = inner - a
+            distances = np.abs(ab[0] * d[:, 1] - ab[1] * d[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def _simplify_arc(arc, tolerance):
+    import numpy as np
+
+    points = np.array(arc, dtype=float)
+    if arc[0] != arc[-1]:
+        return [arc[i] for i in _douglas_peucker(points, tolerance)]
+    # closed ring without junctions: pin the point farthest from the start
+    # as well, so both halves are simplified as open lines
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    if far == 0:
+        return arc
+    head = _douglas_peucker(points[: far + 1], tolerance)
+    tail = _douglas_peucker(points[far:], tolerance) + far
+    return [arc[i] for i in np.concatenate([head, tail[1:]])]
+
+
+def _signed_area(ring):
+    """Shoelace area, negative for clockwise rings"""
+    import numpy as np
+
+    x, y = np.array(ring, dtype=float).T
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def _ring_area(ring):
+    return abs(_signed_area(ring))
+
+
+def _orient(ring, clockwise):
+    """plotly draws with d3-geo, which expects clockwise outer rings and
+    counter-clockwise holes (the reverse of RFC 7946)"""
+    return ring if (_signed_area(ring) < 0) == clockwise else ring[::-1]
+
+
+def simplify(collection, tolerance):
+    """
+    Simplify every ring of a FeatureCollection of (Multi)Polygons while
+    keeping shared borders shared: rings are cut into arcs at the points
+    where borders meet, each arc is simplified once and reused by every ring
+    that runs along it, so neighbouring provinces never gap or overlap.
+    Islands and lakes smaller than the tolerance are dropped.
+    """
+    features = []
+    for feature in collection["features"]:
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+        rings = [[[tuple(p) for p in ring] for ring in polygon] for polygon in polygons]
+        features.append((feature["properties"], rings))
+
+    # a junction is a point with more than two distinct neighbours across all
+    # rings: where a shared border starts, ends or branches
+    neighbours = collections.defaultdict(set)
+    for _, polygons in features:
+        for polygon in polygons:
+            for ring in polygon:
+                for a, b in zip(ring, ring[1:]):
+                    neighbours[a].add(b)
+                    neighbours[b].add(a)
+    junctions = {p for p, near in neighbours.items() if len(near) > 2}
+
+    arcs = {}
+
+    def simplify_ring(ring):
+        cuts = [i for i, p in enumerate(ring[:-1]) if p in junctions]
+        if not cuts:
+            # start the ring at the same point wherever it appears
+            i = ring.index(min(ring[:-1]))
+            pieces = [ring[i:-1] + ring[:i] + [ring[i]]]
+        else:
+            ring = ring[cuts[0] : -1] + ring[: cuts[0] + 1]
+            cuts = [i - cuts[0] for i in cuts] + [len(ring) - 1]
+            pieces = [ring[a : b + 1] for a, b in zip(cuts, cuts[1:])]
+
+        result = []
+        for piece in pieces:
+            key = min(tuple(piece), tuple(piece[::-1]))
+            if key not in arcs:
+                arcs[key] = _simplify_arc(list(key), tolerance)
+            simplified = arcs[key]
+            if list(key) != piece:
+                simplified = simplified[::-1]
+            result.extend(simplified if not result else simplified[1:])
+        return result
+
+    min_area = tolerance * tolerance
+    output = []
+    for properties, polygons in features:
+        simplified = []
+        for polygon in polygons:
+            exterior, *holes = [simplify_ring(ring) for ring in polygon]
+            if len(exterior) < 4 or _ring_area(exterior) < min_area:
+                continue
+            holes = [
+                _orient(h, clockwise=False)
+                for h in holes
+                if len(h) >= 4 and _ring_area(h) >= min_area
+            ]
+            simplified.append([_orient(exterior, clockwise=True)] + holes)
+        if not simplified:
+            # never drop a whole province, keep its largest outer ring as is
+            largest = max(polygons, key=lambda p: _ring_area(p[0]))
+            simplified = [[_orient(largest[0], clockwise=True)]]
+        coordinates = [
+            [[[round(x, PRECISION), round(y, PRECISION)] for x, y in ring] for ring in polygon]
+            for polygon in simplified
+        ]
+        output.append(
+            {
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {"type": "MultiPolygon", "coordinates": coordinates},
+            }
+        )
+    return {"type": "FeatureCollection", "features": output}
+
+
+def write_geojson(collection, path):
+    """Write compact GeoJSON atomically, so the app never serves half a file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(collection, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def build(levels=None):
+    """Write the simplified levels of the source boundaries to assets/geo"""
+    with open(SOURCE, encoding="utf-8") as f:
+        source = json.load(f)
+    for level in levels or LEVELS:
+        path = level_path(level)
+        write_geojson(simplify(source, LEVELS[level]), path)
+        print(f"{level}: {os.path.getsize(path) / 1024:.0f} KB -> {path}")
+    geojson_url.cache_clear()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--echarts"]:
+        # replace the vendored source with a decoded ECharts map
+        write_geojson(read_echarts(sys.argv[2]), SOURCE)
+    else:
+        build(sys.argv[1:] or None)
+
+
+# Usage: python geo.py
+# Usage: python geo.py --echarts Canada.js
+# Usage: geojson_url(level_for_scale(6))
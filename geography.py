@@ -0,0 +1,114 @@
+# Canonical geography (GEO) of the StatCan tables. The tables spell the same
+# geography in different ways and some report parts of a province separately;
+# normalize() resolves both when a table is loaded (see tables.Table), so the
+# charts and the controls deal in one name per geography. GEO is then a
+# categorical with the same categories, i.e. the same integer codes, in every
+# table, and a selection of provinces maps to codes without comparing strings.
+#
+# numpy and pandas are imported where used: controls.py imports this module
+# for geo_list(), which fast startup loads without them.
+
+# the total of the provinces and territories, as named in the controls
+TOTAL = "All Provinces and territories"
+
+PROVINCES = [
+    "Alberta",
+    "British Columbia",
+    "Manitoba",
+    "New Brunswick",
+    "Newfoundland and Labrador",
+    "Northwest Territories",
+    "Northwest Territories including Nunavut",
+    "Nova Scotia",
+    "Nunavut",
+    "Ontario",
+    "Prince Edward Island",
+    "Quebec",
+    "Saskatchewan",
+    "Yukon",
+]
+
+# geographies in the order of the controls
+GEOS = [TOTAL] + PROVINCES
+
+# other spellings of a geography in the tables
+ALIASES = {
+    "Provinces and Territories": TOTAL,
+    "Provinces and territories": TOTAL,
+}
+
+# parts of a geography reported separately in some years, e.g. the two
+# Ontario ministries in the youth tables. The row of the whole already
+# includes them, so they are only summed where it has no value.
+PARTS = {
+    "Ontario, Ministry of Children and Youth Services (MCYS)": "Ontario",
+    "Ontario, Ministry of Community Safety and Correctional Services (MCSCS)": "Ontario",
+}
+
+# GEO categories of every loaded table, sorted like the labels of a plain
+# categorical so grouped results keep their order; the code of a geography
+# is its position here. Labels not listed are appended after them.
+CATEGORIES = sorted(GEOS)
+CODES = {name: code for code, name in enumerate(CATEGORIES)}
+
+
+def canonical(name):
+    """Canonical name of a geography"""
+    return ALIASES.get(name, name)
+
+
+def codes(names):
+    """GEO codes of geography names, ignoring unknown ones (as isin would)"""
+    import numpy as np
+
+    found = (CODES.get(canonical(name)) for name in names)
+    return np.array([code for code in found if code is not None], dtype=np.intp)
+
+
+def _roll_up(df):
+    """Replace the rows of PARTS by their whole: the whole's own value where
+    it has one, else the sum of its parts"""
+    import numpy as np
+    import pandas as pd
+
+    is_part = df["GEO"].isin(list(PARTS)).to_numpy()
+    if not is_part.any():
+        return df
+    keys = [c for c in df.columns if c != "VALUE"]
+    parts = df[is_part].astype({key: object for key in keys})
+    parts["GEO"] = parts["GEO"].map(PARTS)
+    sums = parts.groupby(keys, dropna=False)["VALUE"].sum(min_count=1)
+
+    rest = df[~is_part]
+    is_whole = rest["GEO"].isin(set(PARTS.values())).to_numpy()
+    wholes = pd.MultiIndex.from_frame(rest[is_whole][keys].astype(object))
+    values = rest["VALUE"].to_numpy(dtype=np.float64, copy=True)
+    own = values[is_whole]
+    values[is_whole] = np.where(np.isnan(own), sums.reindex(wholes).to_numpy(), own)
+    missing = sums[~sums.index.isin(wholes)].reset_index()
+    return pd.concat([rest.assign(VALUE=values), missing], ignore_index=True)
+
+
+def normalize(df):
+    """
+    A table with canonical GEO: aliases renamed, parts rolled up into their
+    whole, and GEO a categorical over CATEGORIES. Called once per load.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if "GEO" not in df:
+        return df
+    df = _roll_up(df)
+    # rename the distinct labels, then move each row's code to the new label
+    geo = df["GEO"].astype("category").cat
+    names = [canonical(label) for label in geo.categories]
+    categories = CATEGORIES + sorted(set(names) - CODES.keys())
+    positions = {name: code for code, name in enumerate(categories)}
+    remap = np.array([positions[name] for name in names] + [-1], dtype=np.int64)
+    geo = pd.Categorical.from_codes(remap[geo.codes.to_numpy()], categories)
+    return df.assign(GEO=pd.Series(geo, index=df.index))
+
+
+# Usage: normalize(pd.read_csv("dataset/youth/35100004.csv"))
+# Usage: codes(["Ontario", "Provinces and Territories"])
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Gunicorn settings for `gunicorn wsgi:server`, each overridable from the
+# environment. The app is loaded in the master before forking (see wsgi.py),
+# so adding workers adds little memory: they share the preloaded tables.
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', '8050')}")
+
+# processes, and threads answering callbacks concurrently in each of them
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get("THREADS", 4))
+worker_class = "gthread"
+
+# seconds: a request running longer gets its worker restarted, a stopping
+# worker gets graceful_timeout to finish its requests
+timeout = int(os.environ.get("TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("KEEPALIVE", 5))
+
+# restart workers after this many requests (0 never) to bound slow leaks
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+# load the app, and with it the data, once in the master; failing to load
+# stops gunicorn before any worker starts
+preload_app = True
+
+accesslog = os.environ.get("ACCESS_LOG", "-")
+errorlog = "-"
+
+# the workers' metrics go to files in one directory, which /metrics sums (see
+# metrics.py); a temporary one unless METRICS_DIR names it. Set here, before
+# the app is loaded, so the master and the workers use the same directory.
+if not os.environ.get("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="dash-metrics-")
+    _own_metrics_dir = True
+else:
+    _own_metrics_dir = False
+
+
+def on_starting(server):
+    import metrics
+
+    # values left by an earlier run would be added to this one's
+    metrics.clear_directory()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+# Usage: gunicorn wsgi:server
+# Usage: WEB_CONCURRENCY=8 THREADS=2 TIMEOUT=120 gunicorn wsgi:server
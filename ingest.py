@@ -0,0 +1,204 @@
+import argparse
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import urllib.request
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import store
+import tables
+
+# Ingest of full StatCan table downloads (the "Download entire table" CSV, or
+# the zip it comes in, e.g. https://www150.statcan.gc.ca/n1/tbl/csv/35100154-eng.zip)
+# into dataset/. The raw files repeat a dozen metadata columns on every row
+# and can be hundreds of MB, so they are read in chunks: each chunk is cut
+# down to the columns the charts use (REF_DATE, GEO, the dimensions, VALUE),
+# VALUE is scaled to units, and the rows are appended to the compact CSV. The
+# columnar store (see store.py) is rebuilt from it, and running apps pick the
+# table up through tables.watch.
+#
+#   python ingest.py 35100154-eng.zip
+#   python ingest.py https://www150.statcan.gc.ca/n1/tbl/csv/35100155-eng.zip --group adult
+
+# columns of a full table download that are not dimensions of the data
+METADATA_COLUMNS = {
+    "DGUID",
+    "UOM",
+    "UOM_ID",
+    "SCALAR_FACTOR",
+    "SCALAR_ID",
+    "VECTOR",
+    "COORDINATE",
+    "STATUS",
+    "SYMBOL",
+    "TERMINATED",
+    "DECIMALS",
+}
+
+CHUNK_ROWS = 100_000
+
+
+def table_id(path):
+    """StatCan table id (8 digits) in a download's file name"""
+    match = re.search(r"\d{8}", os.path.basename(path))
+    if match is None:
+        raise ValueError(f"no StatCan table id in {path!r}")
+    return match.group()
+
+
+def table_name(table, group=None):
+    """Registry name ("<group>/<table id>") of a table, looking the group up
+    in tables.TABLES unless given"""
+    if group:
+        return f"{group}/{table}"
+    for name in tables.TABLES:
+        if name.endswith(f"/{table}"):
+            return name
+    raise ValueError(f"table {table} is not in tables.TABLES, pass --group")
+
+
+def open_download(path):
+    """Text stream of the data CSV of a download (.csv or .zip)"""
+    if not zipfile.is_zipfile(path):
+        return open(path, encoding="utf-8-sig", newline="")
+    archive = zipfile.ZipFile(path)
+    member = f"{table_id(path)}.csv"
+    if member not in archive.namelist():
+        raise ValueError(f"{path} has no {member}")
+    return io.TextIOWrapper(archive.open(member), encoding="utf-8-sig", newline="")
+
+
+def fetch(url, directory):
+    """Stream a download to a file instead of holding it in memory"""
+    path = os.path.join(directory, os.path.basename(url.split("?")[0]) or "download")
+    with urllib.request.urlopen(url) as response, open(path, "wb") as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+    return path
+
+
+def dimension_columns(header):
+    """Dimension columns of a download: everything but REF_DATE, GEO, VALUE
+    and the metadata"""
+    return [c for c in header if c not in METADATA_COLUMNS | {"REF_DATE", "GEO", "VALUE"}]
+
+
+def current_columns(name):
+    """Columns of the table's CSV in dataset/, None for a new table"""
+    path = tables.table_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return pd.read_csv(f, nrows=0).columns.tolist()
+
+
+def scale(chunk):
+    """
+    VALUE in units: StatCan stores e.g. thousands as VALUE with SCALAR_ID 3.
+    Rounded to the value's DECIMALS after scaling, so 1.1 thousands is 1100
+    and not 1100.0000000000002.
+    """
+    values = chunk["VALUE"].to_numpy(dtype=float)
+    if "SCALAR_ID" not in chunk:
+        return values
+    scalar = chunk["SCALAR_ID"].fillna(0).to_numpy(dtype=int)
+    if not scalar.any():
+        return values
+    values = values * 10.0**scalar
+    if "DECIMALS" in chunk:
+        decimals = np.maximum(chunk["DECIMALS"].fillna(0).to_numpy(dtype=int) - scalar, 0)
+        for d in np.unique(decimals):
+            mask = decimals == d
+            values[mask] = values[mask].round(d)
+    return values
+
+
+def ingest(source, name, columns=None, chunk_rows=CHUNK_ROWS, build_store=True):
+    """
+    Write the compact CSV of a table from a raw download, `columns` being the
+    dimension columns to keep (default: those of the table's current CSV, or
+    all of them for a new table). Returns the number of rows written.
+    """
+    with open_download(source) as f:
+        header = pd.read_csv(f, nrows=0).columns.tolist()
+    missing = {"REF_DATE", "GEO", "VALUE"} - set(header)
+    if missing:
+        raise ValueError(
+            f"{source} lacks {sorted(missing)}; expected an English full table download"
+        )
+
+    if columns is None:
+        current = current_columns(name)
+        columns = dimension_columns(current if current is not None else header)
+    unknown = set(columns) - set(header)
+    if unknown:
+        raise ValueError(f"{source} has no column {sorted(unknown)}")
+    output = ["REF_DATE", "GEO"] + list(columns) + ["VALUE"]
+    usecols = output + [c for c in ("SCALAR_ID", "DECIMALS") if c in header]
+    # text columns are read as such (no type guessing per chunk), VALUE as float
+    dtype = {c: str for c in output if c != "VALUE"}
+    dtype.update({"VALUE": float, "SCALAR_ID": float, "DECIMALS": float})
+
+    path = tables.table_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    rows = 0
+    try:
+        with open_download(source) as f, open(tmp, "w", encoding="utf-8", newline="") as out:
+            chunks = pd.read_csv(
+                f,
+                usecols=usecols,
+                dtype={c: t for c, t in dtype.items() if c in usecols},
+                chunksize=chunk_rows,
+            )
+            for chunk in chunks:
+                chunk["VALUE"] = scale(chunk)
+                chunk[output].to_csv(out, header=rows == 0, index=False)
+                rows += len(chunk)
+        # replace the CSV in one step so the app never reads half of it
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    if build_store:
+        store.build_table(name, path)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a full StatCan table download")
+    parser.add_argument("source", help="downloaded .zip or .csv, or its url")
+    parser.add_argument("--group", help="dataset folder (adult, youth) of a new table")
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        help="dimension columns to keep (default: those of the current CSV, or all)",
+    )
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--no-store", action="store_true", help="only write the CSV")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.source
+        if re.match(r"https?://", source):
+            source = fetch(source, directory)
+        name = table_name(table_id(source), args.group)
+        rows = ingest(source, name, args.columns, args.chunk_rows, not args.no_store)
+    print(f"{name}: {rows} rows -> {tables.table_path(name)}")
+    if name not in tables.TABLES:
+        print(f"add {name!r} to tables.TABLES to use it in the charts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Usage: python ingest.py 35100154-eng.zip
+# Usage: python ingest.py 35100155-eng.zip --group adult --columns "Custodial and community supervision"
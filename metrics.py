@@ -0,0 +1,373 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import Response, g, request
+
+# Callback metrics in the Prometheus text format, served at /metrics. The
+# histograms, counters and gauges need no client library or collector:
+# recording a request is a dictionary lookup, a bisect and a few additions
+# under a lock.
+#
+# Under gunicorn a scrape reaches one worker, so the workers keep their values
+# in a directory they share, as prometheus_client's multiprocess mode does:
+# each process adds to its own memory-mapped file, and /metrics sums the files
+# of all of them. Counters and histograms of exited workers still count; the
+# in-flight gauges of a worker are dropped when it exits (see
+# mark_process_dead, called from gunicorn.conf.py).
+#
+#   METRICS_DIR=/path/to/dir   shared by the processes of one server, cleared
+#                              when it starts (gunicorn.conf.py sets one)
+#   unset                      kept in this process only
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(256 * 4**i for i in range(9))  # 256 B to 16 MB
+
+CALLBACK_PATH = "/_dash-update-component"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ProcessValues:
+    """Sample values of this process: {key: number}"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+
+_USED = struct.Struct("<Q")  # file header: bytes in use
+_VALUE = struct.Struct("<d")
+
+
+class SharedValues:
+    """
+    Sample values of the processes sharing a directory. Each process adds to
+    its own file, <prefix>_<pid>.db, memory-mapped so that an addition writes
+    no more than a double in place. An entry is the length of its key, the key
+    (JSON, padded to 8 bytes) and the value; the header counts the bytes in
+    use, updated once an entry is complete, so readers never see half of one.
+    """
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def path(self, pid):
+        return os.path.join(self.directory, f"{self.prefix}_{pid}.db")
+
+    def _open(self):
+        # a file per process: one mapped in the master is not the workers'
+        self._pid = os.getpid()
+        self._offsets = {}  # key -> offset of its value
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(self.path(self._pid), "a+b")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(mmap.PAGESIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        (used,) = _USED.unpack_from(self._map)
+        if used == 0:
+            _USED.pack_into(self._map, 0, _USED.size)
+        for key, offset in _entries(self._map):
+            self._offsets[key] = offset
+
+    def _append(self, key):
+        encoded = json.dumps(key).encode()
+        padded = encoded + b" " * (-len(encoded) % 8)
+        (used,) = _USED.unpack_from(self._map)
+        end = used + _USED.size + len(padded) + _VALUE.size
+        if end > len(self._map):
+            size = len(self._map)
+            while size < end:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        _USED.pack_into(self._map, used, len(padded))
+        self._map[used + _USED.size : end - _VALUE.size] = padded
+        _VALUE.pack_into(self._map, end - _VALUE.size, 0.0)
+        _USED.pack_into(self._map, 0, end)
+        self._offsets[key] = end - _VALUE.size
+        return end - _VALUE.size
+
+    def add(self, key, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            offset = self._offsets.get(key)
+            if offset is None:
+                offset = self._append(key)
+            (value,) = _VALUE.unpack_from(self._map, offset)
+            _VALUE.pack_into(self._map, offset, value + amount)
+
+    def collect(self):
+        """The values of every process, summed per key"""
+        values = {}
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}_*.db")):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # a process that exited in the meantime
+                continue
+            for key, offset in _entries(data):
+                (value,) = _VALUE.unpack_from(data, offset)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def remove(self, pid):
+        try:
+            os.remove(self.path(pid))
+        except FileNotFoundError:
+            pass
+
+
+def _entries(data):
+    """(key, offset of its value) of each entry of a values file"""
+    if len(data) < _USED.size:
+        return
+    (used,) = _USED.unpack_from(data)
+    position = _USED.size
+    while position < used:
+        (length,) = _USED.unpack_from(data, position)
+        position += _USED.size
+        name, labels, index = json.loads(bytes(data[position : position + length]))
+        position += length
+        yield (name, tuple(labels), index), position
+        position += _VALUE.size
+
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+
+
+def _values(prefix):
+    if METRICS_DIR:
+        return SharedValues(METRICS_DIR, prefix)
+    return ProcessValues()
+
+
+# counter and histogram values, kept after a process exits; gauge values,
+# dropped with their process
+totals = _values("totals")
+live = _values("live")
+
+
+def clear_directory():
+    """Remove the values of every process from METRICS_DIR"""
+    for values in (totals, live):
+        if isinstance(values, SharedValues):
+            for path in glob.glob(values.path("*")):
+                os.remove(path)
+
+
+def mark_process_dead(pid):
+    """Drop the gauges of an exited process (gunicorn's child_exit hook)"""
+    if isinstance(live, SharedValues):
+        live.remove(pid)
+
+
+class Metric:
+    kind = None
+    values = totals
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def _add(self, labels, amount, index=0):
+        self.values.add((self.name, labels, index), amount)
+
+    def samples(self, values):
+        """(suffix, labels, value) of the samples in {key: value}"""
+        raise NotImplementedError
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples(values):
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return "\n".join(lines)
+
+    def _series(self, values):
+        """{labels: {index: value}} of this metric, sorted by labels"""
+        series = {}
+        for (name, labels, index), value in values.items():
+            if name == self.name:
+                series.setdefault(labels, {})[index] = value
+        return sorted(series.items())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._add(labels, amount)
+
+    def samples(self, values):
+        for labels, value in self._series(values):
+            yield "", _labels(self.label_names, labels), value[0]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+    values = live
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # one count per bucket (not cumulative), +Inf, then the sum
+        self._add(labels, 1, bisect.bisect_left(self.buckets, value))
+        self._add(labels, value, len(self.buckets) + 1)
+
+    def samples(self, values):
+        for labels, counts in self._series(values):
+            total = 0
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                total += counts.get(i, 0)
+                le = [("le", _number(bound) if bound != float("inf") else "+Inf")]
+                yield "_bucket", _labels(self.label_names, labels, le), total
+            yield "_sum", _labels(self.label_names, labels), counts.get(len(self.buckets) + 1, 0)
+            yield "_count", _labels(self.label_names, labels), total
+
+
+callback_duration = Histogram(
+    "dash_callback_duration_seconds",
+    "Time to answer a callback request.",
+    ["callback", "trigger"],
+)
+callback_response_bytes = Histogram(
+    "dash_callback_response_bytes",
+    "Size of callback responses.",
+    ["callback"],
+    SIZE_BUCKETS,
+)
+callback_in_flight = Gauge(
+    "dash_callback_in_flight",
+    "Callback requests being answered.",
+    ["callback"],
+)
+callback_errors = Counter(
+    "dash_callback_errors_total",
+    "Callback requests that failed (status 500 or above).",
+    ["callback"],
+)
+callback_responses = Counter(
+    "dash_callback_responses_total",
+    "Callback responses by status code (204 means nothing was updated).",
+    ["callback", "status"],
+)
+
+METRICS = [
+    callback_duration,
+    callback_response_bytes,
+    callback_in_flight,
+    callback_errors,
+    callback_responses,
+]
+
+
+def render():
+    values = {**totals.collect(), **live.collect()}
+    return "\n".join(metric.render(values) for metric in METRICS) + "\n"
+
+
+def callback_name(app, body):
+    """Name of the python function answering a callback request, or its
+    output for callbacks without one"""
+    output = body.get("output", "")
+    callback = app.callback_map.get(output, {}).get("callback")
+    return getattr(callback, "__name__", None) or output.split("@")[0]
+
+
+def _trigger(body):
+    """The input that fired the callback; "initial" on page load"""
+    changed = body.get("changedPropIds") or []
+    return changed[0] if changed else "initial"
+
+
+def instrument(app):
+    """Record the callback requests of a Dash app and serve /metrics"""
+    server = app.server
+
+    @server.before_request
+    def start_callback():
+        if request.path != CALLBACK_PATH:
+            return
+        body = request.get_json(silent=True) or {}
+        g.metrics_callback = callback_name(app, body)
+        g.metrics_trigger = _trigger(body)
+        g.metrics_start = time.perf_counter()
+        callback_in_flight.inc(g.metrics_callback)
+
+    @server.after_request
+    def record_response(response):
+        name = g.get("metrics_callback")
+        if name is not None:
+            g.metrics_status = response.status_code
+            size = response.calculate_content_length()
+            if size is not None:
+                callback_response_bytes.observe(size, name)
+        return response
+
+    @server.teardown_request
+    def end_callback(error=None):
+        name = g.pop("metrics_callback", None)
+        if name is None:
+            return
+        callback_in_flight.dec(name)
+        callback_duration.observe(
+            time.perf_counter() - g.metrics_start, name, g.metrics_trigger
+        )
+        status = g.pop("metrics_status", 500 if error is not None else None)
+        if status is not None:
+            callback_responses.inc(name, str(status))
+        if error is not None or (status or 0) >= 500:
+            callback_errors.inc(name)
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+
+# Usage: metrics.instrument(app)
+# Usage: curl localhost:8050/metrics
@@ -0,0 +1,39 @@
+from dash import Patch
+
+# Partial figure updates: when a new figure has the same structure as the one
+# already on the page (same traces and layout keys), only the values that
+# differ are sent, e.g. the trace arrays and title text while scrubbing the
+# year slider.
+
+
+def _structure(figure):
+    traces = tuple(
+        (trace.get("type"), trace.get("name"), tuple(sorted(trace)))
+        for trace in figure.get("data", [])
+    )
+    layout = tuple(sorted(k for k in figure.get("layout", {}) if k != "template"))
+    return traces, layout, "frames" in figure
+
+
+def figure_patch(old, new):
+    """
+    Return a Patch turning figure dict `old` into `new`, or None when their
+    structure differs and the full figure has to be sent. The layout template
+    is left alone since the page applies the theme itself.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return None
+    if _structure(old) != _structure(new):
+        return None
+
+    patch = Patch()
+    for i, (old_trace, new_trace) in enumerate(zip(old["data"], new["data"])):
+        for key, value in new_trace.items():
+            if old_trace[key] != value:
+                patch["data"][i][key] = value
+    for key, value in new.get("layout", {}).items():
+        if key != "template" and old["layout"][key] != value:
+            patch["layout"][key] = value
+    if old.get("frames") != new.get("frames"):
+        patch["frames"] = new["frames"]
+    return patch
@@ -0,0 +1,181 @@
+import argparse
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from flask import g, request
+
+import metrics
+
+# Opt-in profiling of callbacks and figure functions. Each profiled call is
+# saved to PROFILE_DIR as a cProfile dump (.prof) next to a .json file with
+# the callback or function name and its inputs, and `python profiling.py`
+# adds up the saved profiles into the hottest functions.
+#
+# Profiling is off unless
+#   PROFILE_CALLBACKS=1       profiles every callback request and every figure
+#                             computed outside of a request (e.g. at startup)
+#   PROFILE_TOKEN=<secret>    profiles the callback requests of pages opened
+#                             with ?profile=<secret>, so a slow selection can
+#                             be captured in production without a restart
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(ROOT, "profiles"))
+ENABLED = os.environ.get("PROFILE_CALLBACKS", "") not in ("", "0")
+TOKEN = os.environ.get("PROFILE_TOKEN")
+
+_local = threading.local()
+
+
+def _active():
+    return getattr(_local, "active", False)
+
+
+def requested():
+    """Whether the current request asks to be profiled with the token, as a
+    query parameter of the page (the referrer of callback requests) or of
+    the request itself"""
+    if not TOKEN:
+        return False
+    for url in (request.referrer or "", request.url):
+        if TOKEN in parse_qs(urlsplit(url).query).get("profile", []):
+            return True
+    return False
+
+
+def save(profile, tag, inputs, duration):
+    """Write a profile and its description, return the path of the dump"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    digest = hashlib.sha1(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()[:8]
+    name = re.sub(r"[^\w.-]+", "_", tag)[:80]
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    stem = os.path.join(PROFILE_DIR, f"{stamp}-{name}-{digest}")
+    profile.dump_stats(stem + ".prof")
+    with open(stem + ".json", "w") as f:
+        json.dump(
+            {"tag": tag, "inputs": inputs, "duration": duration, "created": time.time()},
+            f,
+            indent=1,
+            default=str,
+        )
+    return stem + ".prof"
+
+
+def call(tag, func, *args):
+    """
+    func(*args), profiled and saved when PROFILE_CALLBACKS is set. Calls made
+    while a callback request is being profiled are part of that profile.
+    """
+    if not ENABLED or _active():
+        return func(*args)
+    profile = cProfile.Profile()
+    _local.active = True
+    start = time.perf_counter()
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        _local.active = False
+        save(profile, tag, {"args": list(args)}, time.perf_counter() - start)
+
+
+def instrument(app):
+    """Profile the callback requests of a Dash app when enabled"""
+    server = app.server
+
+    @server.before_request
+    def start_profile():
+        if request.path != metrics.CALLBACK_PATH or _active():
+            return
+        if not (ENABLED or requested()):
+            return
+        body = request.get_json(silent=True) or {}
+        g.profile_tag = metrics.callback_name(app, body)
+        g.profile_inputs = {
+            key: body.get(key) for key in ("changedPropIds", "inputs", "state")
+        }
+        g.profile_start = time.perf_counter()
+        g.profile = cProfile.Profile()
+        _local.active = True
+        g.profile.enable()
+
+    @server.teardown_request
+    def save_profile(error=None):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        _local.active = False
+        save(
+            profile,
+            g.profile_tag,
+            g.profile_inputs,
+            time.perf_counter() - g.profile_start,
+        )
+
+
+def saved_profiles(directory=PROFILE_DIR, match=None):
+    """(dump path, description) of the saved profiles, oldest first,
+    optionally only those whose tag contains `match`"""
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for entry in sorted(os.listdir(directory)):
+        if not entry.endswith(".prof"):
+            continue
+        path = os.path.join(directory, entry)
+        try:
+            with open(path[: -len(".prof")] + ".json") as f:
+                description = json.load(f)
+        except (OSError, ValueError):
+            description = {"tag": entry}
+        if match and match not in description.get("tag", ""):
+            continue
+        found.append((path, description))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hottest functions of saved profiles")
+    parser.add_argument("directory", nargs="?", default=PROFILE_DIR)
+    parser.add_argument("--match", help="only profiles whose callback/function name contains this")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--sort", default="cumulative", choices=["cumulative", "tottime", "ncalls"])
+    parser.add_argument("--list", action="store_true", help="list the profiles and their inputs")
+    args = parser.parse_args(argv)
+
+    profiles = saved_profiles(args.directory, args.match)
+    if not profiles:
+        print(f"no profiles in {args.directory}")
+        return 1
+    if args.list:
+        for path, description in profiles:
+            duration = description.get("duration")
+            duration = f"{duration * 1000:8.1f} ms" if duration is not None else " " * 11
+            inputs = json.dumps(description.get("inputs"), default=str)
+            print(f"{duration}  {description.get('tag')}  {inputs[:200]}  {path}")
+        return 0
+
+    stats = pstats.Stats(profiles[0][0])
+    for path, _ in profiles[1:]:
+        stats.add(path)
+    print(f"{len(profiles)} profiles")
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Usage: PROFILE_TOKEN=s3cret python app.py, then open http://localhost:8050/?profile=s3cret
+# Usage: python profiling.py --match adult_custody_gender_heatmap --top 15 --sort tottime
@@ -0,0 +1,327 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import geography
+import tables
+
+# Declarative queries over the loaded tables. The figure functions of
+# data_adult and data_youth describe the rows they need (table, year window,
+# label filters, group-by keys) as a Query and call run(); this is the one
+# place where the data is filtered and summed, so caching and profiling can
+# hook in here.
+#
+# The pandas backend fuses every label filter into a single pass over the
+# category codes of the year slice (see tables.encode), and only then takes
+# the matching rows out of the table, so no intermediate frame is copied.
+# GEO has the same codes in every table (see geography.py), so selected
+# provinces are looked up by code rather than compared as strings.
+# Sums grouped by dimensions are answered from a prefix-sum cube (cube.py)
+# when the query allows it. The DuckDB backend runs the same query as SQL
+# over the loaded table; duckdb is optional and imported on first use.
+#
+#   QUERY_BACKEND=pandas   default
+#   QUERY_BACKEND=duckdb   needs `pip install duckdb`
+
+
+class Query:
+    """
+    Rows of a table, or VALUE summed over them:
+
+    table     registry name, e.g. "adult/35100014"
+    years     (start_year, end_year), the fiscal years as in tables.get_years
+    where     {column: labels to keep}, e.g. {"Sex": ["Male"]}
+    exclude   {column: labels to drop}
+    contains  {column: pattern the labels must contain (a regular expression,
+              as in Series.str.contains)}
+    dropna    drop the rows without a VALUE
+    relabel   {column: {label: merged label}}, applied before the filters, e.g.
+              to fold the two Ontario ministries into "Ontario"
+    by        columns to group by; the result is then the grouped columns and
+              the summed measure, sorted by the groups, as
+              df.groupby(by, observed=True)[measure].sum().reset_index()
+    columns   columns of the rows returned when not grouping (default all)
+    """
+
+    def __init__(
+        self,
+        table,
+        years=None,
+        where=None,
+        exclude=None,
+        contains=None,
+        dropna=False,
+        relabel=None,
+        by=None,
+        columns=None,
+        measure="VALUE",
+    ):
+        self.table = table
+        self.years = years
+        self.where = {c: list(labels) for c, labels in (where or {}).items()}
+        self.exclude = {c: list(labels) for c, labels in (exclude or {}).items()}
+        self.contains = dict(contains or {})
+        self.dropna = dropna
+        self.relabel = dict(relabel or {})
+        self.by = list(by) if by else None
+        self.columns = list(columns) if columns else None
+        self.measure = measure
+
+    def filtered_columns(self):
+        """Columns with a label filter, in the order given"""
+        return list(dict.fromkeys([*self.where, *self.exclude, *self.contains]))
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in vars(self).items() if value
+        )
+        return f"Query({fields})"
+
+
+def _labels(column, values):
+    """Filter labels as stored in the tables: aliases of geographies resolved"""
+    if column == "GEO":
+        return [geography.canonical(value) for value in values]
+    return values
+
+
+def _year_slice(table, years):
+    if years is None:
+        return slice(0, len(table.df))
+    return table.year_slice(*years)
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def run(self, query):
+        table = tables.get_loaded(query.table)
+        if self.uses_cube(table, query):
+            return self._cube_sum(table, query)
+        rows = _year_slice(table, query.years)
+        codes = {
+            column: self.codes(table.df, column, query.relabel.get(column))
+            for column in set(query.filtered_columns()) | set(query.by or ()) | set(query.relabel)
+        }
+        positions = np.arange(rows.start, rows.stop)[self.mask(table.df, rows, query, codes)]
+
+        columns = list(query.by) + [query.measure] if query.by else query.columns
+        df = table.df if columns is None else table.df[columns]
+        df = df.take(positions)
+        for column in query.relabel:
+            if column in df:
+                column_codes, labels = codes[column]
+                df[column] = pd.Categorical.from_codes(column_codes[positions], labels)
+        if not query.by:
+            return df
+        return df.groupby(query.by, observed=True)[query.measure].sum().reset_index()
+
+    @staticmethod
+    def uses_cube(table, query):
+        """
+        Group-by sums over categorical dimensions come from the table's cube
+        over the grouped and filtered columns. Not for REF_DATE (the cube
+        sums over the years) nor with dropna (a cube cell counts every row).
+        """
+        if not query.by or query.dropna or query.years is None or query.measure != "VALUE":
+            return False
+        dims = set(query.by) | set(query.filtered_columns())
+        return "REF_DATE" not in dims and all(
+            isinstance(table.df[column].dtype, pd.CategoricalDtype) for column in dims
+        )
+
+    @staticmethod
+    def codes(df, column, relabel=None):
+        """Category codes and labels of a column, merging relabeled labels"""
+        column = df[column].cat
+        codes = column.codes.to_numpy()
+        labels = column.categories
+        if relabel:
+            new_codes, labels = pd.factorize(labels.map(lambda l: relabel.get(l, l)), sort=True)
+            # a code of -1 (missing label) indexes the appended -1 and stays missing
+            codes = np.append(new_codes, -1)[codes]
+            labels = pd.Index(labels)
+        return codes, labels
+
+    @staticmethod
+    def allowed(query, column, labels):
+        """Boolean per label of a column: whether its rows pass the filters"""
+
+        def isin(values):
+            if column == "GEO" and column not in query.relabel:
+                found = np.zeros(len(labels), dtype=bool)
+                found[geography.codes(values)] = True
+                return found
+            return labels.isin(values)
+
+        keep = np.ones(len(labels), dtype=bool)
+        if column in query.where:
+            keep &= isin(query.where[column])
+        if column in query.exclude:
+            keep &= ~isin(query.exclude[column])
+        if column in query.contains:
+            keep &= np.asarray(labels.str.contains(query.contains[column]), dtype=bool)
+        return keep
+
+    def mask(self, df, rows, query, codes):
+        """All the filters of a query evaluated in one pass over the codes of
+        the rows: a lookup of each row's label in the column's allowed labels"""
+        mask = np.ones(rows.stop - rows.start, dtype=bool)
+        for column in query.filtered_columns():
+            column_codes, labels = codes[column]
+            # rows without a label only pass an exclude, as with isin
+            missing = column not in query.where and column not in query.contains
+            lookup = np.append(self.allowed(query, column, labels), missing)
+            mask &= lookup[column_codes[rows]]
+        if query.dropna:
+            mask &= df[query.measure].notna().to_numpy()[rows]
+        return mask
+
+    def _cube_sum(self, table, query):
+        # dimensions in table order, so queries over the same columns share a cube
+        wanted = set(query.by) | set(query.filtered_columns())
+        dims = [column for column in table.df.columns if column in wanted]
+        relabel = {c: m for c, m in query.relabel.items() if c in dims}
+        cube = tables.get_cube(query.table, dims, relabel or None)
+        # the cube filters its labels itself; patterns become the labels they match
+        where = {column: _labels(column, values) for column, values in query.where.items()}
+        exclude = {column: _labels(column, values) for column, values in query.exclude.items()}
+        for column in query.contains:
+            labels = pd.Index(cube.labels[cube.dims.index(column)])
+            where[column] = labels[self.allowed(query, column, labels)]
+        return cube.sum(*query.years, by=query.by, where=where, exclude=exclude)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class DuckDBBackend:
+    name = "duckdb"
+
+    def __init__(self):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError(
+                "QUERY_BACKEND=duckdb needs the duckdb package: pip install duckdb"
+            ) from None
+        self._duckdb = duckdb
+        self._local = threading.local()
+
+    def _connection(self):
+        # a connection per thread: a duckdb connection runs one query at a time
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._duckdb.connect()
+        return connection
+
+    def run(self, query):
+        table = tables.get_loaded(query.table)
+        rows = _year_slice(table, query.years)
+        frame = table.df.iloc[rows].assign(__row=np.arange(rows.start, rows.stop))
+        sql, params = self.sql(query, table.df.columns)
+        connection = self._connection()
+        connection.register("t", frame)
+        try:
+            result = connection.execute(sql, params).df()
+        finally:
+            connection.unregister("t")
+        if query.by:
+            return result
+        return result.set_index("__row").rename_axis(None)
+
+    @staticmethod
+    def sql(query, all_columns):
+        """SELECT statement of a query over the view "t" and its parameters"""
+        params = []
+
+        def expression(column):
+            expr = _quote(column)
+            if column == query.measure:
+                return expr
+            expr = f"CAST({expr} AS VARCHAR)"
+            relabel = query.relabel.get(column)
+            if relabel:
+                cases = " ".join("WHEN ? THEN ?" for _ in relabel)
+                for label, merged in relabel.items():
+                    params.extend([label, merged])
+                expr = f"CASE {expr} {cases} ELSE {expr} END"
+            return expr
+
+        def labels(column, values):
+            values = _labels(column, values)
+            params.extend(values)
+            return "(" + ", ".join("?" for _ in values) + ")"
+
+        if query.by:
+            select = [f"{expression(c)} AS {_quote(c)}" for c in query.by]
+            select.append(f"COALESCE(SUM({_quote(query.measure)}), 0) AS {_quote(query.measure)}")
+        else:
+            columns = query.columns or list(all_columns)
+            select = [f"{expression(c)} AS {_quote(c)}" for c in columns] + ["__row"]
+
+        conditions = []
+        for column in query.filtered_columns():
+            if column in query.where:
+                if query.where[column]:
+                    expr = expression(column)
+                    conditions.append(f"{expr} IN {labels(column, query.where[column])}")
+                else:
+                    conditions.append("FALSE")
+            if query.exclude.get(column):
+                conditions.append(
+                    f"({expression(column)} IS NULL"
+                    f" OR {expression(column)} NOT IN {labels(column, query.exclude[column])})"
+                )
+            if column in query.contains:
+                params.append(query.contains[column])
+                conditions.append(f"regexp_matches({expression(column)}, ?)")
+        if query.dropna:
+            measure = _quote(query.measure)
+            conditions.append(f"{measure} IS NOT NULL AND NOT isnan({measure})")
+
+        # the select list is built first so the parameters are in statement order
+        sql = f"SELECT {', '.join(select)} FROM t"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if query.by:
+            # by position: the names would refer to the columns before relabeling
+            keys = ", ".join(str(i + 1) for i in range(len(query.by)))
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        else:
+            sql += " ORDER BY __row"
+        return sql, params
+
+
+BACKENDS = {"pandas": PandasBackend, "duckdb": DuckDBBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Backend instance by name, QUERY_BACKEND (default pandas) when None"""
+    name = name or os.environ.get("QUERY_BACKEND", "pandas")
+    if name not in BACKENDS:
+        raise ValueError(f"unknown query backend {name!r}, expected one of {sorted(BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+def run(query, backend=None):
+    """
+    Result of a query as a DataFrame. Rows keep the order and index they have
+    in the table (sorted by year); grouped sums are sorted by the groups. All
+    the tables a figure queries are read in one snapshot (see tables.snapshot).
+    """
+    with tables.snapshot():
+        return get_backend(backend).run(query)
+
+
+# Usage: run(Query("adult/35100015", (2000, 2010), where={"Sex": ["Male"]}))
+# Usage: run(Query("youth/35100004", (2000, 2010), by=["GEO"]), backend="duckdb")
@@ -0,0 +1,226 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+# Figure JSON shared by the worker processes of a node, so a figure computed
+# by one worker is a hit for all the others (see figure_cache.py, which keeps
+# its in-process LRU in front of it). Backends store bytes under string keys;
+# SQLiteBackend needs no other service, and anything implementing
+# CacheBackend (e.g. over a network cache) can be plugged in through
+# backend_from_url.
+#
+#   FIGURE_CACHE_URL=sqlite:////var/cache/justice/figures.sqlite  (default under .cache/)
+#   FIGURE_CACHE_URL=none                                         in-process cache only
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_URL = "sqlite:///" + os.path.join(ROOT, ".cache", "figures.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60
+
+# a read refreshes the entry's last access time at most this often (seconds),
+# so hot entries are not rewritten on every hit
+ACCESS_RESOLUTION = 10
+
+
+def hash_key(*parts):
+    """Fixed-length key for any repr-able parts, e.g. a figure cache key"""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class CacheBackend:
+    """Interface of a shared cache: bytes values under string keys, each
+    with a time to live in seconds"""
+
+    def get(self, key):
+        """The value stored under key, or None when missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def info(self):
+        """Dictionary of sizes and counters, for monitoring"""
+        return {}
+
+    def close(self):
+        """Release connections; the backend reconnects when next used"""
+
+
+def _close_before_fork(ref):
+    backend = ref()
+    if backend is not None:
+        backend.close()
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache in a SQLite file, safe to share between processes and threads.
+    Every write is a transaction, so readers never see half an entry.
+    Expired entries are dropped first, then the least recently read ones
+    until the values fit in max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.errors = 0
+        self._local = threading.local()
+        self._connections = []  # open in this process, see close
+        self._generation = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        # SQLite connections must not cross a fork: the gunicorn master opens
+        # one while preloading, so it is closed before the workers are forked
+        os.register_at_fork(before=functools.partial(_close_before_fork, weakref.ref(self)))
+
+    def _connect(self):
+        # one connection per thread and per process, until close()
+        owner = (os.getpid(), self._generation)
+        db_owner, db = getattr(self._local, "db", (None, None))
+        if db_owner != owner:
+            # closed by close(), which may run in another thread
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = (owner, db)
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def close(self):
+        """Close the connections of every thread of this process, e.g. before
+        forking; the threads reconnect on their next call"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for db in connections:
+            try:
+                db.close()
+            except sqlite3.Error:
+                self.errors += 1
+
+    def get(self, key):
+        now = time.time()
+        try:
+            db = self._connect()
+            row = db.execute(
+                "SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            if now - row[2] > ACCESS_RESOLUTION:
+                db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error:
+            # a busy or broken cache is a miss, never a failed callback
+            self.errors += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        try:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), expires, now),
+                )
+                self._evict(db, now)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            stale.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def delete(self, key):
+        try:
+            self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+        except sqlite3.Error:
+            self.errors += 1
+
+    def clear(self):
+        try:
+            self._connect().execute("DELETE FROM entries")
+        except sqlite3.Error:
+            self.errors += 1
+
+    def info(self):
+        try:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            entries = size = None
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "errors": self.errors,
+        }
+
+
+def backend_from_url(url, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+    """Backend for a cache url, or None for "none" / an empty url"""
+    if not url or url == "none":
+        return None
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite":
+        # sqlite:///relative/path or sqlite:////absolute/path, as in SQLAlchemy
+        path = parts.path[1:] if parts.path.startswith("/") else parts.path
+        return SQLiteBackend(path, max_bytes, ttl)
+    raise ValueError(f"unsupported figure cache url {url!r}")
+
+
+def from_environ():
+    """Backend configured by FIGURE_CACHE_URL, FIGURE_CACHE_SHARED_BYTES and
+    FIGURE_CACHE_TTL"""
+    return backend_from_url(
+        os.environ.get("FIGURE_CACHE_URL", DEFAULT_URL),
+        int(os.environ.get("FIGURE_CACHE_SHARED_BYTES", DEFAULT_MAX_BYTES)),
+        float(os.environ.get("FIGURE_CACHE_TTL", DEFAULT_TTL)),
+    )
+
+
+# Usage: backend = backend_from_url("sqlite:////tmp/figures.sqlite"); backend.set(hash_key("a", 1), b"{}")
+# Usage: FIGURE_CACHE_URL=none python app.py
@@ -0,0 +1,83 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Import-time report of the app: runs `python -X importtime -c "import app"`
+# in a fresh interpreter and lists the modules that take longest to import,
+# by cumulative time (the module and everything it imports first) and by self
+# time. Worker restarts and cold starts pay this on every process, so
+# --budget fails (exit 1) when importing the app takes longer than allowed.
+#
+#   python startup.py
+#   FAST_STARTUP=1 python startup.py --budget 3
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module="app", fast=None):
+    """
+    Import `module` in a subprocess and return (wall seconds, rows) with one
+    row (name, self us, cumulative us, depth) per imported module
+    """
+    env = dict(os.environ)
+    if fast is not None:
+        env["FAST_STARTUP"] = "1" if fast else "0"
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            rows.append((name, int(own), int(cumulative), len(indent) // 2))
+    return wall, rows
+
+
+def report(wall, rows, module="app", top=20):
+    lines = [f"import {module}: {wall:.2f} s wall"]
+    total = next((r[2] for r in rows if r[0] == module), None)
+    if total is not None:
+        lines[0] += f", {total / 1e6:.2f} s importing"
+    for title, key in [("cumulative", 2), ("self", 1)]:
+        lines.append(f"\ntop {top} by {title} time")
+        for name, own, cumulative, depth in sorted(rows, key=lambda r: -r[key])[:top]:
+            lines.append(f"{cumulative / 1000:9.1f} ms {own / 1000:9.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time report of the app")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--fast", action="store_true", help="measure with FAST_STARTUP=1")
+    parser.add_argument("--budget", type=float, help="fail when the import takes longer (seconds)")
+    args = parser.parse_args(argv)
+
+    wall, rows = measure(args.module, fast=True if args.fast else None)
+    print(report(wall, rows, args.module, args.top))
+    if args.budget is not None and wall > args.budget:
+        print(f"\nOVER BUDGET: {wall:.2f} s > {args.budget:.2f} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Usage: python startup.py --top 10
+# Usage: python startup.py --fast --budget 3
@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Columnar binary copy of the dataset/ CSVs, prepared the way tables.Table
+# holds them (canonical GEO, dictionary-encoded, sorted by year). Every column
+# is written to its own .npy file: categorical columns as their integer codes,
+# with the labels kept in meta.json, numeric columns as-is. Loading memory-maps
+# the files and uses them as the columns without copying, so startup skips CSV
+# parsing and forked workers share the pages.
+#
+# Build (or refresh) the store with: python store.py
+
+STORE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "dataset", ".store"
+)
+META_FILE = "meta.json"
+# bumped when the stored layout changes, so older copies are rebuilt from the CSV
+FORMAT = 3
+
+
+def store_path(name):
+    """Directory holding the column files of a table"""
+    return os.path.join(STORE_DIR, name)
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _code_dtype(n_labels):
+    # -1 marks a missing label, so the dtype must be signed
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_labels < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def write_table(df, name, source=None):
+    """Write a DataFrame to the store, replacing any previous copy of it"""
+    target = store_path(name)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, column in enumerate(df.columns):
+        file_name = f"{i}.npy"
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # keep the categories (and so the codes) as they are, e.g. GEO's
+            # shared by every table
+            labels = series.cat.categories
+            values = series.cat.codes.to_numpy().astype(_code_dtype(len(labels)))
+            columns.append(
+                {"name": column, "file": file_name, "labels": labels.tolist()}
+            )
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            values = series.to_numpy()
+            columns.append({"name": column, "file": file_name})
+        else:
+            codes, labels = pd.factorize(series, sort=True)
+            values = codes.astype(_code_dtype(len(labels)))
+            columns.append(
+                {"name": column, "file": file_name, "labels": labels.tolist()}
+            )
+        np.save(os.path.join(tmp, file_name), values)
+
+    meta = {"format": FORMAT, "rows": len(df), "columns": columns, "source": source}
+    with open(os.path.join(tmp, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    # swap the finished directory in so readers never see a partial table
+    old = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def build_table(name, csv_path):
+    """Parse a CSV once, prepare it as tables.Table does and write its columns
+    to the store"""
+    import tables
+
+    df = tables.prepare(pd.read_csv(csv_path, low_memory=False))
+    write_table(df, name, source=_source_stamp(csv_path))
+    return df
+
+
+def read_meta(name):
+    try:
+        with open(os.path.join(store_path(name), META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(name, csv_path):
+    """True when the stored copy was built from the current CSV"""
+    meta = read_meta(name)
+    if meta is None or meta.get("format") != FORMAT:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return meta["source"] == _source_stamp(csv_path)
+
+
+def load_table(name):
+    """
+    Load a stored table with its columns memory-mapped: the arrays of the
+    frame are the (read-only) mapped files themselves.
+    """
+    meta = read_meta(name)
+    if meta is None:
+        raise FileNotFoundError(f"{name} is not in the columnar store")
+    data = {}
+    for column in meta["columns"]:
+        values = np.load(
+            os.path.join(store_path(name), column["file"]), mmap_mode="r"
+        )
+        if "labels" in column:
+            # the memory-mapped codes are used as they are, code -1 is missing;
+            # they were written from a categorical, so need no validation
+            dtype = pd.CategoricalDtype(column["labels"])
+            values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def build(names, csv_path):
+    for name in names:
+        path = csv_path(name)
+        if not os.path.exists(path):
+            print(f"skipped {name}: {path} not found")
+            continue
+        df = build_table(name, path)
+        print(f"built {name}: {len(df)} rows")
+
+
+if __name__ == "__main__":
+    import tables
+
+    build(sys.argv[1:] or tables.TABLES, tables.table_path)
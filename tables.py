@@ -0,0 +1,364 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import geography
+import store
+from cube import YearCube
+
+# Shared registry of the StatCan tables under dataset/. Each table is parsed
+# once per process and the same frame is handed out to every chart function.
+#
+# StatCan republishes the tables in place: watch() polls their files and
+# reloads a changed table in the background, then swaps the new copy in. Each
+# loaded table carries the version (size and mtime) of its file, and everything
+# derived from it (cubes, get_derived values) lives on the loaded table, so it
+# is dropped with it. Code running in snapshot() sees one version of each
+# table throughout, even if a reload lands halfway.
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
+
+# tables used by the charts, named "<group>/<table id>" after their path
+TABLES = [
+    "adult/35100014",
+    "adult/35100015",
+    "adult/35100016",
+    "adult/35100017",
+    "adult/35100018",
+    "adult/35100154",
+    "youth/35100003",
+    "youth/35100004",
+    "youth/35100005",
+    "youth/35100006",
+    "youth/35100007",
+]
+
+_tables = {}
+_locks = {}
+_registry_lock = threading.Lock()
+_local = threading.local()
+_watcher = None  # (pid, thread) of the watch() thread of this process
+
+
+def table_path(name):
+    """Path of the CSV file backing a table"""
+    return os.path.join(DATASET_DIR, f"{name}.csv")
+
+
+def _table_lock(name):
+    with _registry_lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def file_version(name):
+    """(size, mtime_ns) of the file backing a table, None when it is missing"""
+    try:
+        stat = os.stat(table_path(name))
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_table(name):
+    # prefer the prebuilt columnar copy (see store.py) while it matches the CSV;
+    # the version is taken first so a write during the read shows as a change
+    path = table_path(name)
+    version = file_version(name)
+    if store.is_fresh(name, path):
+        return Table(store.load_table(name), version, prepared=True)
+    return Table(pd.read_csv(path, low_memory=False), version)
+
+
+# VALUE is kept as float32 when that loses nothing: every value and every sum
+# of them (up to the total of the column) is then an exact float32
+FLOAT32_EXACT = 2**24
+
+
+def compact_values(values):
+    """VALUE as float32 when exact (e.g. counts), float64 otherwise"""
+    values = values.to_numpy(dtype=np.float64)
+    compact = values.astype(np.float32)
+    if np.nansum(np.abs(values)) < FLOAT32_EXACT and np.array_equal(
+        compact, values, equal_nan=True
+    ):
+        return compact
+    return values
+
+
+def encode(df):
+    """
+    Dictionary-encode a table: every text column (the dimensions, GEO and
+    REF_DATE) becomes a categorical, i.e. small integer codes into one copy
+    of each label, and VALUE a compact float. Filters such as isin and ==
+    then compare codes instead of strings.
+    """
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        if name == "VALUE":
+            column = pd.Series(compact_values(column), name=name, index=column.index)
+        elif not (
+            isinstance(column.dtype, pd.CategoricalDtype)
+            or pd.api.types.is_numeric_dtype(column.dtype)
+        ):
+            column = column.astype("category")
+        columns[name] = column
+    return pd.DataFrame(columns, copy=False)
+
+
+def _start_years(df):
+    # parse each distinct fiscal year once, then look the rows up by code
+    ref_dates = df["REF_DATE"].cat
+    return ref_dates.categories.str[:4].astype(int).to_numpy()[ref_dates.codes]
+
+
+def prepare(df):
+    """
+    A parsed table as Table holds it: canonical GEO (see
+    geography.normalize), dictionary-encoded (see encode) and sorted by
+    REF_DATE. The columnar store keeps tables prepared (see store.py).
+    """
+    df = encode(geography.normalize(df))
+    order = np.argsort(_start_years(df), kind="stable")
+    if not (order == np.arange(len(order))).all():
+        df = df.iloc[order].reset_index(drop=True)
+    return df
+
+
+class Table:
+    """
+    A loaded table, prepared (see prepare) unless it comes prepared from the
+    store, whose memory-mapped columns are then used as they are. The fiscal
+    years ("2000/2001") are parsed once into integer start and end year arrays
+    aligned with its rows.
+    """
+
+    def __init__(self, df, version=None, prepared=False):
+        if not prepared:
+            df = prepare(df)
+        ref_dates = df["REF_DATE"].cat
+        codes = ref_dates.codes.to_numpy()
+        self.df = df
+        self.start_years = _start_years(df)
+        self.end_years = ref_dates.categories.str[5:].astype(int).to_numpy()[codes]
+        self.version = version
+        # aggregate cubes and other values derived from this table, see
+        # get_cube and get_derived
+        self.cubes = {}
+        self.derived = {}
+
+    def year_slice(self, start_year, end_year):
+        """Row positions of the fiscal years starting at or after start_year and
+        ending at or before end_year"""
+        lo = np.searchsorted(self.start_years, start_year, side="left")
+        hi = np.searchsorted(self.end_years, end_year, side="right")
+        return slice(lo, max(lo, hi))
+
+
+def _get(name):
+    pinned = getattr(_local, "pinned", None)
+    if pinned is not None and name in pinned:
+        return pinned[name]
+    table = _tables.get(name)
+    if table is None:
+        # one lock per table so concurrent first requests parse it only once
+        with _table_lock(name):
+            table = _tables.get(name)
+            if table is None:
+                table = _read_table(name)
+                _tables[name] = table
+    if pinned is not None:
+        pinned[name] = table
+    return table
+
+
+@contextlib.contextmanager
+def snapshot():
+    """
+    Pin each table at its first access within the block, so later accesses
+    in the same thread get the same version even if it is reloaded
+    meanwhile. Yields the pinned {name: Table}, i.e. the tables used so far.
+    Nested blocks share the outer snapshot.
+    """
+    pinned = getattr(_local, "pinned", None)
+    if pinned is not None:
+        yield pinned
+        return
+    _local.pinned = {}
+    try:
+        yield _local.pinned
+    finally:
+        _local.pinned = None
+
+
+def version(name):
+    """Version of the loaded copy of a table, or of its file (the version it
+    would be loaded at) when it is not loaded yet"""
+    table = _tables.get(name)
+    return table.version if table is not None else file_version(name)
+
+
+def get_loaded(name):
+    """The loaded Table of a name (frame, year arrays, cubes), for code that
+    reads its columns directly such as query.py. Do not modify it."""
+    return _get(name)
+
+
+def get_table(name):
+    """
+    Return the table as a DataFrame, parsing the CSV only on first use.
+
+    The cached frame is shared between callers, so a shallow copy is returned:
+    assigning or dropping columns on it never leaks into other callbacks.
+    """
+    return _get(name).df.copy(deep=False)
+
+
+def get_years(name, start_year, end_year):
+    """
+    Return the rows of a table whose fiscal year lies within start_year and
+    end_year, e.g. 2000/2001 through 2009/2010 for (2000, 2010).
+
+    Rows are sorted by year, so this is a binary search and a slice instead of
+    parsing REF_DATE on every call.
+    """
+    table = _get(name)
+    return table.df.iloc[table.year_slice(start_year, end_year)]
+
+
+def get_cube(name, dims, relabel=None):
+    """
+    Return the prefix-sum cube (see cube.py) of a table over the given
+    dimension columns, building it on first use. Cubes live on the loaded
+    table, so invalidating the table drops them as well.
+    """
+    table = _get(name)
+    key = (tuple(dims), repr(relabel))
+    cube = table.cubes.get(key)
+    if cube is None:
+        with _table_lock(name):
+            cube = table.cubes.get(key)
+            if cube is None:
+                cube = YearCube(table, dims, relabel)
+                table.cubes[key] = cube
+    return cube
+
+
+def get_derived(name, key, build):
+    """
+    build() computed once per loaded version of a table and kept on it like
+    the cubes. build runs in a snapshot pinning that version, so it must read
+    the table through this module. Do not modify the result.
+    """
+    with snapshot():
+        table = _get(name)
+        value = table.derived.get(key)
+        if value is None:
+            value = table.derived[key] = build()
+    return value
+
+
+def reload(name):
+    """
+    Read a table again and swap the new copy in. Requests already holding
+    the old copy keep using it; its cubes and derived values go with it.
+    """
+    table = _read_table(name)
+    with _table_lock(name):
+        _tables[name] = table
+    return table
+
+
+def changed_tables():
+    """Loaded tables whose file changed since they were read"""
+    return [
+        name
+        for name, table in list(_tables.items())
+        if file_version(name) != table.version
+    ]
+
+
+def watch(interval=30):
+    """
+    Start a thread reloading the loaded tables whose files change, checking
+    every `interval` seconds. Once per process: threads do not survive a
+    fork, so forked workers call this again and get their own.
+    """
+    global _watcher
+    if _watcher is not None and _watcher[0] == os.getpid():
+        return
+    with _registry_lock:
+        if interval <= 0 or (_watcher is not None and _watcher[0] == os.getpid()):
+            return
+        thread = threading.Thread(target=_watch, args=(interval,), name="tables-watch", daemon=True)
+        _watcher = (os.getpid(), thread)
+    thread.start()
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        for name in changed_tables():
+            try:
+                reload(name)
+                print(f"reloaded {name}", file=sys.stderr)
+            except Exception as e:
+                # keep serving the copy already loaded, e.g. while the file is
+                # still being written; the next check tries again
+                print(f"reloading {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+def invalidate(name=None):
+    """Drop one cached table (or all of them) so the next access re-reads it"""
+    with _registry_lock:
+        if name is None:
+            _tables.clear()
+        else:
+            _tables.pop(name, None)
+
+
+def loaded_tables():
+    """Names of the tables currently held in memory"""
+    return sorted(_tables)
+
+
+def memory_report(names=None):
+    """(name, bytes of the frame as parsed from the CSV, bytes once encoded)
+    for each table, counting the strings the columns point to. Tables whose
+    CSV is missing are skipped."""
+    report = []
+    for name in names or TABLES:
+        path = table_path(name)
+        if not os.path.exists(path):
+            print(f"skipped {name}: {path} not found", file=sys.stderr)
+            continue
+        df = pd.read_csv(path, low_memory=False)
+        report.append(
+            (
+                name,
+                int(df.memory_usage(deep=True).sum()),
+                int(encode(df).memory_usage(deep=True).sum()),
+            )
+        )
+    return report
+
+
+if __name__ == "__main__":
+    report = memory_report(sys.argv[1:])
+    print(f"{'table':20} {'parsed':>10} {'encoded':>10} {'ratio':>6}")
+    for name, parsed, encoded in report:
+        print(f"{name:20} {parsed / 1024:8.0f}KB {encoded / 1024:8.0f}KB {parsed / encoded:6.1f}")
+    parsed, encoded = (sum(r[i] for r in report) for i in (1, 2))
+    if report:
+        print(f"{'total':20} {parsed / 1024:8.0f}KB {encoded / 1024:8.0f}KB {parsed / encoded:6.1f}")
+
+
+# Usage: get_table("adult/35100014") or get_years("adult/35100014", 2000, 2010)
+# Usage: invalidate("youth/35100003") or invalidate()
+# Usage: watch(interval=60), or reload("adult/35100154") after replacing its CSV
+# Usage: python tables.py (bytes per table before and after encoding)
@@ -0,0 +1,222 @@
+import json
+import os
+import sys
+
+import pytest
+
+# no shared figure cache and no dataset watcher: every request is counted in
+# this process, see FigureCache.requests
+os.environ["FIGURE_CACHE_URL"] = "none"
+os.environ["DATASET_WATCH_INTERVAL"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dash_bootstrap_components as dbc  # noqa: E402
+from dash_bootstrap_templates import ThemeChangerAIO  # noqa: E402
+
+import app  # noqa: E402
+import tables  # noqa: E402
+
+THEME = ThemeChangerAIO.ids.radio("theme")
+
+# CSVs of the tables not in dataset/: the figures reading them fail, and only
+# with FileNotFoundError on one of these
+MISSING = {
+    tables.table_path(name)
+    for name in tables.TABLES
+    if not os.path.exists(tables.table_path(name))
+}
+
+
+def id_key(component_id):
+    if isinstance(component_id, str):
+        return component_id
+    return json.dumps(component_id, sort_keys=True, separators=(",", ":"))
+
+
+class DashClient:
+    """
+    Fires the server callbacks of the app through /_dash-update-component
+    the way the renderer does: a changed property fires each callback it is
+    an input of once, and the properties those callbacks return fire the
+    next wave. Clientside callbacks are not run.
+    """
+
+    def __init__(self, dash_app):
+        # callback errors propagate instead of turning into a 500
+        dash_app.server.testing = True
+        self.client = dash_app.server.test_client()
+        self.props = {}  # (id key, property) -> value
+        self._collect(self.client.get("/_dash-layout").get_json())
+        self.callbacks = [
+            dep
+            for dep in self.client.get("/_dash-dependencies").get_json()
+            if not dep.get("clientside_function")
+        ]
+
+    def _collect(self, node):
+        if isinstance(node, list):
+            for child in node:
+                self._collect(child)
+        elif isinstance(node, dict) and "props" in node:
+            props = node["props"]
+            if "id" in props:
+                for prop, value in props.items():
+                    if prop != "children":
+                        self.props[(id_key(props["id"]), prop)] = value
+            self._collect(props.get("children"))
+
+    def _matching(self, spec):
+        """Ids of the layout matching a dependency id, wildcards included"""
+        if not spec.startswith("{"):
+            return [spec]
+        pattern = json.loads(spec)
+        found = []
+        for key, _ in self.props:
+            if key.startswith("{") and key not in found:
+                candidate = json.loads(key)
+                if set(candidate) == set(pattern) and all(
+                    value == ["ALL"] or candidate[name] == value
+                    for name, value in pattern.items()
+                ):
+                    found.append(key)
+        return found
+
+    def _values(self, dependencies):
+        values = []
+        for dep in dependencies:
+            spec = id_key(dep["id"])
+            entries = [
+                {
+                    "id": json.loads(key) if key.startswith("{") else key,
+                    "property": dep["property"],
+                    "value": self.props.get((key, dep["property"])),
+                }
+                for key in self._matching(spec)
+            ]
+            values.append(entries if "ALL" in spec else entries[0])
+        return values
+
+    def _outputs(self, output):
+        output = output.split("@")[0]
+        parts = output.strip(".").split("...") if output.startswith("..") else [output]
+        outputs = []
+        for part in parts:
+            spec, prop = part.rsplit(".", 1)
+            entries = [
+                {"id": json.loads(key) if key.startswith("{") else key, "property": prop}
+                for key in self._matching(spec)
+            ]
+            outputs.append(entries if "ALL" in spec else entries[0])
+        return outputs if output.startswith("..") else outputs[0]
+
+    def _fire(self, callback, changed):
+        payload = {
+            "output": callback["output"],
+            "outputs": self._outputs(callback["output"]),
+            "inputs": self._values(callback["inputs"]),
+            "state": self._values(callback["state"]),
+            "changedPropIds": changed,
+        }
+        try:
+            response = self.client.post("/_dash-update-component", json=payload)
+        except FileNotFoundError as e:
+            assert e.filename in MISSING, e
+            return []
+        assert response.status_code in (200, 204), response.status_code
+        if response.status_code == 204:
+            # PreventUpdate
+            return []
+        updated = []
+        for key, props in response.get_json()["response"].items():
+            for prop, value in props.items():
+                # figures may come as a Patch; only the stores matter here
+                if not (isinstance(value, dict) and value.get("__dash_patch_update")):
+                    self.props[(key, prop)] = value
+                updated.append(f"{key}.{prop}")
+        return updated
+
+    def set(self, component_id, prop, value):
+        """Change a property as the user would and run the callbacks it fires"""
+        self.props[(id_key(component_id), prop)] = value
+        changed = [f"{id_key(component_id)}.{prop}"]
+        while changed:
+            updated = []
+            for callback in self.callbacks:
+                inputs = {
+                    f"{key}.{dep['property']}"
+                    for dep in callback["inputs"]
+                    if "MATCH" not in id_key(dep["id"])
+                    for key in self._matching(id_key(dep["id"]))
+                }
+                if inputs & set(changed):
+                    updated += self._fire(callback, changed)
+            changed = updated
+
+
+def affected(tab, control_id=None):
+    """Figure functions of a tab depending on a control (all of them without
+    one), each requested once"""
+    return {
+        path.rsplit(".", 1)[1]: 1
+        for _, path, control_ids, _ in app.FIGURES[tab]
+        if control_id is None or control_id in control_ids
+    }
+
+
+@pytest.fixture(scope="module")
+def client():
+    app.figures.clear()
+    return DashClient(app.app)
+
+
+def requests_for(client, component_id, prop, value):
+    app.figures.reset_counters()
+    client.set(component_id, prop, value)
+    return dict(app.figures.requests)
+
+
+# each interaction requests every figure it affects exactly once, and only
+# those; the steps run in order on one page
+@pytest.mark.parametrize(
+    "component_id, prop, value, expected",
+    [
+        ("years", "value", [2003, 2012], affected("adult", "years")),
+        ("provinces", "value", ["Alberta", "Ontario"], affected("adult", "provinces")),
+        ("radio", "value", "Probation", affected("adult", "radio")),
+        ("radio2", "value", "Male", affected("adult", "radio2")),
+        ("map-year", "value", 2005, affected("adult", "map-year")),
+        (THEME, "value", dbc.themes.DARKLY, {}),
+        ("tabs", "active_tab", "youth", affected("youth")),
+        ("youth-radio", "value", "Probation", affected("youth", "youth-radio")),
+        ("tabs", "active_tab", "adult", {}),
+        ("years", "value", [2003, 2012], {}),
+    ],
+    ids=[
+        "years",
+        "provinces",
+        "radio",
+        "radio2",
+        "map-year",
+        "theme",
+        "youth tab",
+        "youth radio",
+        "back to adult",
+        "same years",
+    ],
+)
+def test_requests_per_interaction(client, component_id, prop, value, expected):
+    assert requests_for(client, component_id, prop, value) == expected
+
+
+# a page whose default figures are not cached is served without them, and
+# each of them is then requested once by its own callback
+def test_pending_figures_load_once():
+    app.figures.clear()
+    page = DashClient(app.app)
+    pending = page.props[("pending-figures", "data")]
+    assert pending == [name for name, _, _, _ in app.FIGURES["adult"]]
+    app.figures.reset_counters()
+    for name in pending:
+        page.set({"type": "figure-load", "index": name}, "data", True)
+    assert dict(app.figures.requests) == affected("adult")
+    assert DashClient(app.app).props[("pending-figures", "data")] == []
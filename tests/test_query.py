@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geography  # noqa: E402
+import query  # noqa: E402
+import tables  # noqa: E402
+from cube import YearCube  # noqa: E402
+from query import Query  # noqa: E402
+
+PROVINCES = ["Alberta", "Ontario", "Quebec"]
+
+
+def plain(df):
+    """A result with its labels as strings and VALUE as float64, to compare
+    results whatever the dtypes each way of computing them returns"""
+    return df.astype({c: float if c == "VALUE" else str for c in df.columns})
+
+
+def grouped(df, by, where=None, exclude=None):
+    """The plain groupby sum the cube stands in for"""
+    for column, labels in (where or {}).items():
+        df = df[df[column].isin(labels)]
+    for column, labels in (exclude or {}).items():
+        df = df[~df[column].isin(labels)]
+    return df.groupby(by, observed=True)["VALUE"].sum().reset_index()
+
+
+# the cube's sum over a year window equals the groupby sum of the same rows
+@pytest.mark.parametrize(
+    "name, dims, years, by, where, exclude",
+    [
+        ("adult/35100014", ["GEO"], (2000, 2010), ["GEO"], None, None),
+        (
+            "adult/35100015",
+            ["GEO", "Custodial admissions", "Sex"],
+            (2003, 2012),
+            ["Sex"],
+            {"GEO": PROVINCES, "Custodial admissions": ["Remand", "Sentenced"]},
+            None,
+        ),
+        (
+            "adult/35100015",
+            ["GEO", "Sex"],
+            (1990, 2030),
+            ["Sex", "GEO"],
+            None,
+            {"GEO": [geography.TOTAL]},
+        ),
+        (
+            "youth/35100004",
+            ["GEO", "Initial entry status"],
+            (2005, 2006),
+            ["Initial entry status"],
+            {"GEO": PROVINCES},
+            {"Initial entry status": ["Total correctional services"]},
+        ),
+    ],
+    ids=["one dim", "filtered", "all years", "one year"],
+)
+def test_cube_sum_matches_groupby(name, dims, years, by, where, exclude):
+    cube = YearCube(tables.get_loaded(name), dims)
+    expected = grouped(tables.get_years(name, *years), by, where, exclude)
+    result = cube.sum(*years, by=by, where=where, exclude=exclude)
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(plain(result), plain(expected))
+
+
+QUERIES = [
+    Query("adult/35100015", (2000, 2010), where={"Sex": ["Male"]}),
+    Query(
+        "adult/35100015",
+        (2003, 2012),
+        where={"GEO": PROVINCES},
+        exclude={"Custodial admissions": ["Total, custodial admissions"]},
+        columns=["REF_DATE", "GEO", "VALUE"],
+    ),
+    Query(
+        "youth/35100004",
+        (2000, 2020),
+        contains={"Initial entry status": "custody"},
+        dropna=True,
+        by=["REF_DATE", "Initial entry status"],
+    ),
+    Query(
+        "youth/35100004",
+        (2000, 2010),
+        exclude={"GEO": [geography.TOTAL]},
+        by=["GEO"],
+    ),
+    Query(
+        "adult/35100014",
+        (1990, 2030),
+        relabel={"Custodial and community admissions": {"Remand": "Custody", "Sentenced": "Custody"}},
+        where={"Custodial and community admissions": ["Custody", "Probation"]},
+        by=["Custodial and community admissions"],
+    ),
+]
+
+
+# the DuckDB backend returns what the pandas one does, rows and index included
+@pytest.mark.parametrize(
+    "q",
+    QUERIES,
+    ids=["where", "columns", "contains by year", "cube", "relabel"],
+)
+def test_backends_agree(q):
+    pytest.importorskip("duckdb")
+    expected = query.run(q, backend="pandas")
+    result = query.run(q, backend="duckdb")
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(plain(result), plain(expected), check_index_type=False)
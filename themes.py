@@ -0,0 +1,83 @@
+import functools
+
+import plotly.io as pio
+from dash import Patch
+from dash_bootstrap_templates import template_from_url
+
+# Figures are computed without a theme and cached (see figure_cache.py); the
+# Bootstrap theme picked in ThemeChangerAIO swaps layout.template, either on a
+# copy of a cached figure or as a Patch on the figures already shown.
+#
+# plotly express writes the colours it picks from the template it computed
+# with (the process default, recorded in the figure's layout.template) into the
+# traces: marker and line colours from its colorway, the colour axis scale from
+# its sequential colorscale. Those are mapped to the same position in the
+# theme's template, so a figure gets the colours it would have had if computed
+# with the theme.
+
+COLOR_KEYS = ("marker", "line")
+
+
+@functools.lru_cache(maxsize=None)
+def template_json(theme):
+    """Plotly template for a Bootstrap theme stylesheet url, as plain JSON"""
+    return pio.templates[template_from_url(theme)].to_plotly_json()
+
+
+def recolor(figure, theme):
+    """
+    The template colours baked into a figure dict, mapped to the theme's:
+    ([(trace index, key, colour)], colour axis scale or None)
+    """
+    source = figure.get("layout", {}).get("template", {}).get("layout", {})
+    target = template_json(theme).get("layout", {})
+    colorway = target.get("colorway")
+    colors = {}
+    if colorway:
+        colors = {
+            color: colorway[i % len(colorway)]
+            for i, color in enumerate(source.get("colorway", []))
+        }
+    traces = []
+    for i, trace in enumerate(figure.get("data", [])):
+        for key in COLOR_KEYS:
+            color = trace.get(key, {}).get("color")
+            if isinstance(color, str) and color in colors:
+                traces.append((i, key, colors[color]))
+
+    scale = figure.get("layout", {}).get("coloraxis", {}).get("colorscale")
+    sequential = source.get("colorscale", {}).get("sequential")
+    if scale is None or scale != sequential:
+        scale = None
+    else:
+        scale = target.get("colorscale", {}).get("sequential")
+    return traces, scale
+
+
+def apply_theme(figure, theme):
+    """Return a cached figure dict with the theme's template and colours,
+    copying only the traces it recolours"""
+    if not isinstance(figure, dict):
+        return figure
+    traces, scale = recolor(figure, theme)
+    data = list(figure.get("data", []))
+    for i, key, color in traces:
+        data[i] = dict(data[i], **{key: dict(data[i][key], color=color)})
+    layout = dict(figure.get("layout", {}), template=template_json(theme))
+    if scale is not None:
+        layout["coloraxis"] = dict(layout["coloraxis"], colorscale=scale)
+    return dict(figure, data=data, layout=layout)
+
+
+def theme_patch(theme, figure=None):
+    """Partial update that restyles a figure already on the page; with the
+    cached figure dict it shows, its template colours are mapped as well"""
+    patch = Patch()
+    patch["layout"]["template"] = template_json(theme)
+    if isinstance(figure, dict):
+        traces, scale = recolor(figure, theme)
+        for i, key, color in traces:
+            patch["data"][i][key]["color"] = color
+        if scale is not None:
+            patch["layout"]["coloraxis"]["colorscale"] = scale
+    return patch
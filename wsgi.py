@@ -0,0 +1,73 @@
+import gc
+import os
+import sys
+import time
+
+import app as dashboard
+import geo
+import store
+import tables
+
+# Production entry point: `gunicorn wsgi:server` (settings in gunicorn.conf.py).
+# Gunicorn imports this module once in the master process (preload_app), which
+# loads every table, builds the cubes and renders the default figures of each
+# tab before forking. The workers then share that memory copy-on-write instead
+# of each parsing the dataset, and a broken table stops the server at startup
+# instead of failing the first request that needs it. A table whose file is
+# missing altogether is reported and skipped: only the figures reading it fail.
+
+
+def missing_tables():
+    """Tables with neither a CSV nor a copy in the columnar store"""
+    return [
+        name
+        for name in tables.TABLES
+        if not os.path.exists(tables.table_path(name)) and store.read_meta(name) is None
+    ]
+
+
+def preload(missing=()):
+    """Load all the data the callbacks use but the missing tables, raising on
+    the first failure"""
+    start = time.perf_counter()
+    for name in tables.TABLES:
+        if name not in missing:
+            tables.get_table(name)
+    for level in geo.LEVELS:
+        geo.geojson_url(level)
+
+    # the default figures of every tab, into the figure cache: the adult ones
+    # go in the layout of each page (see app.serve_layout), the others only
+    # warm the cache and the cubes their figure functions build
+    for tab in dashboard.FIGURES:
+        dashboard.prerender(tab)
+
+    # move everything loaded so far out of the collector's reach: collections
+    # in the workers would otherwise write to these objects' headers and copy
+    # the shared pages
+    gc.collect()
+    gc.freeze()
+    return time.perf_counter() - start
+
+
+missing = missing_tables()
+if missing:
+    print(
+        f"missing tables, their figures will fail: {', '.join(missing)}",
+        file=sys.stderr,
+    )
+try:
+    elapsed = preload(missing)
+except Exception as e:
+    print(f"preloading the data failed: {type(e).__name__}: {e}", file=sys.stderr)
+    raise
+print(
+    f"preloaded {len(tables.loaded_tables())} tables in {elapsed:.1f} s",
+    file=sys.stderr,
+)
+
+server = dashboard.app.server
+
+
+# Usage: gunicorn wsgi:server
+# Usage: python -c "import wsgi" to check that the data loads